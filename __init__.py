@@ -2,6 +2,24 @@ from .signal import S
 from .match_trans import MatchTrans
 from .format_trans import FormatTrans
 from .trans import Trans
-from .store import Store
+from .store import Store, CompactStore
+from .compiled_template import CompiledTemplate
 from .in_n_out import InNOut
-from .interface import match, format, transform
+from .orm import prefetch_queryset, project_queryset
+from .interface import compile, match, format, iter_format, transform, match_many, transform_many
+
+# Imported when first used, as their dependencies (multiprocessing, xml, gzip, csv) are slow to import
+_lazy = {
+    'transform_parallel': 'parallel',
+    'register_function': 'parallel',
+    'match_stream': 'streaming',
+    'write_ndjson': 'export',
+    'write_csv': 'export',
+}
+
+
+def __getattr__(name):
+    if name in _lazy:
+        import importlib
+        return getattr(importlib.import_module(f".{_lazy[name]}", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
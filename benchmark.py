@@ -0,0 +1,406 @@
+'''
+Benchmarks for InNOut.
+
+Run from the parent directory of the package:
+    python -m in_n_out.benchmark
+
+Timing suite, with results saved as JSON to compare commits:
+    python -m in_n_out.benchmark --suite --output before.json
+    python -m in_n_out.benchmark --suite --compare before.json
+'''
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from . import S, InNOut, MatchTrans, FormatTrans, transform, utils
+
+
+def make_profiles(width):
+    return {
+        'profile_list': [{
+            'first_name': f"first_name_{i}",
+            'last_name': f"last_name_{i}",
+            'addresses': [{
+                'street': f"{i} main st",
+                'postal_code': str(10000 + i),
+            }],
+        } for i in range(width)]
+    }
+
+
+profiles_template = {
+    'profile_list': [{
+        'first_name': S('first_name'),
+        'last_name': S('last_name'),
+        'addresses': [{
+            'street': S('street_address'),
+            'postal_code': S('postal_code'),
+        }],
+    }]
+}
+
+
+def bench_store_memory(width):
+    '''
+    Memory held by the stores of a match, for `Store` and `CompactStore`.
+    '''
+    data = make_profiles(width)
+    compiled = InNOut.compile(profiles_template)
+
+    results = {}
+    for compact in (False, True):
+        gc.collect()
+        tracemalloc.start()
+        matched = InNOut(compiled, data, compact=compact)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results['compact' if compact else 'default'] = {'current': current, 'peak': peak}
+        del matched
+
+    results['reduction'] = 1 - results['compact']['current'] / results['default']['current']
+    return results
+
+
+_bench_model = None
+
+
+def bench_model():
+    '''
+    Model of the QuerySet benchmark, in an in memory SQLite database when Django isn't configured yet.
+    '''
+    global _bench_model
+    if _bench_model is not None:
+        return _bench_model
+
+    import django
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}})
+        django.setup()
+    from django.db import models
+
+    class Row(models.Model):
+        name = models.CharField(max_length=64)
+        amount = models.IntegerField()
+        notes = models.TextField()
+
+        class Meta:
+            app_label = 'in_n_out_benchmark'
+
+    _bench_model = Row
+    return Row
+
+
+rows_template = [{
+    'name': S('name'),
+    'amount': S('amount'),
+}]
+
+
+def bench_queryset_memory(rows, chunk_size):
+    '''
+    Peak memory of matching a QuerySet of `rows` rows, with every row cached by the QuerySet and iterated by chunks.
+    '''
+    from django.db import connection
+
+    Row = bench_model()
+    with connection.schema_editor() as editor:
+        editor.create_model(Row)
+    try:
+        Row.objects.bulk_create(Row(name=f"name_{i}", amount=i, notes='n' * 200) for i in range(rows))
+        compiled = InNOut.compile(rows_template)
+
+        results = {}
+        for name, size in (('cached', None), ('chunked', chunk_size)):
+            gc.collect()
+            tracemalloc.start()
+            matched = InNOut(compiled, Row.objects.all(), chunk_size=size)
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[name] = {'current': current, 'peak': peak}
+            del matched
+    finally:
+        with connection.schema_editor() as editor:
+            editor.delete_model(Row)
+
+    results['reduction'] = 1 - results['chunked']['peak'] / results['cached']['peak']
+    return results
+
+
+def bench_import_time(module, repeat=5):
+    '''
+    Cumulative import time of `module` in a fresh interpreter, as reported by `python -X importtime`, in microseconds.
+    The median of `repeat` runs is returned.
+    '''
+    # The package is imported from its parent directory
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    times = []
+    for _ in range(repeat):
+        res = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], cwd=cwd, capture_output=True, text=True, check=True)
+        # Lines are `import time: self [us] | cumulative | imported package`
+        for line in res.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                times.append(int(fields[1]))
+    return statistics.median(times)
+
+
+###########
+# SUITE
+###########
+
+def make_nested(width, depth):
+    '''
+    `width` items, each the root of a binary tree of `depth` levels
+    '''
+    def node(idx, level):
+        item = {'id': idx, 'value': f"value_{level}_{idx}", 'flag': level % 2}
+        if level < depth:
+            item['children'] = [node(f"{idx}.{j}", level + 1) for j in range(2)]
+        return item
+
+    return {'items': [node(str(i), 1) for i in range(width)]}
+
+
+def nested_template(depth, signal=S):
+    def node(level):
+        item = {'value': signal(f"value_{level}")}
+        if level < depth:
+            item['children'] = [node(level + 1)]
+        return item
+
+    return {'items': [node(1)]}
+
+
+def transposed_template(depth, signal=S):
+    '''
+    One record for each of the deepest items, with the values of all their parents
+    '''
+    return [{f"value_{level}": signal(f"value_{level}") for level in range(1, depth + 1)}]
+
+
+def match_upper(signal):
+    return MatchTrans(S(signal), str.upper)
+
+
+def format_lower(signal):
+    return FormatTrans(S(signal), str.lower)
+
+
+def make_crossings(width):
+    '''
+    Profiles with 2 addresses, each with 2 street crossings, as `test_transpose_street_crossing_name`
+    '''
+    return {
+        'profile_list': [{
+            'first_name': f"first_name_{i}",
+            'addresses': [{
+                'postal_code': str(10000 + j),
+                'crossings': [{'name': f"crossing_{i}_{j}_{k}"} for k in range(2)],
+            } for j in range(2)],
+        } for i in range(width)]
+    }
+
+
+crossings_template = {
+    'profile_list': [{
+        'first_name': S('first_name'),
+        'addresses': [{
+            'postal_code': S('postal_code'),
+            'crossings': [{'name': S('street_crossing_name')}],
+        }],
+    }]
+}
+
+
+def case_match(width, depth):
+    data = make_nested(width, depth)
+    compiled = InNOut.compile(nested_template(depth))
+    return lambda: InNOut(compiled, data)
+
+
+def case_format(width, depth):
+    matched = InNOut(nested_template(depth), make_nested(width, depth))
+    compiled = InNOut.compile(nested_template(depth))
+    return lambda: matched.format(compiled)
+
+
+def case_transform(width, depth):
+    data = make_nested(width, depth)
+    match_template = InNOut.compile(nested_template(depth))
+    format_template = InNOut.compile(transposed_template(depth))
+    return lambda: transform(data, match_template, format_template)
+
+
+def case_format_repeated(width, depth):
+    '''
+    Values of the deepest items gathered for each item, several times
+    '''
+    matched = InNOut(nested_template(depth), make_nested(width, depth))
+    signal = f"value_{depth}"
+    compiled = InNOut.compile({f"values_{i}": [S(signal)] for i in range(3)})
+    return lambda: matched.format(compiled)
+
+
+def case_deepest_stores(width, depth):
+    store = InNOut(nested_template(depth), make_nested(width, depth)).root_store
+    signals = [S(f"value_{level}") for level in range(1, depth + 1)]
+    return lambda: store.get_deepest_stores_for_signals(signals)
+
+
+def case_transpose(width, depth):
+    matched = InNOut(crossings_template, make_crossings(width))
+    compiled = InNOut.compile([{
+        'first_names': S('first_name'),
+        'postal_code': S('postal_code'),
+        'street_crossing_name': S('street_crossing_name'),
+    }])
+    return lambda: matched.format(compiled)
+
+
+def case_trans(width, depth):
+    data = make_nested(width, depth)
+    match_template = InNOut.compile(nested_template(depth, match_upper))
+    format_template = InNOut.compile(transposed_template(depth, format_lower))
+    return lambda: transform(data, match_template, format_template)
+
+
+def case_dict_join(width, depth):
+    rows = [{'id': i % width, f"value_{i // width}": i} for i in range(2 * width)]
+    return lambda: utils.dict_join([dict(row) for row in rows], 'id')
+
+
+# name -> (function returning the function to time for a width & depth, whether the case depends on the depth)
+SUITE = {
+    'match': (case_match, True),
+    'format': (case_format, True),
+    'transform': (case_transform, True),
+    'format_repeated': (case_format_repeated, True),
+    'deepest_stores': (case_deepest_stores, True),
+    'transpose': (case_transpose, False),
+    'trans': (case_trans, True),
+    'dict_join': (case_dict_join, False),
+}
+
+
+def git_commit():
+    try:
+        res = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+        return res.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(widths, depths, repeat=5, cases=None):
+    '''
+    Time each case of the suite for each width & depth, keeping the best and median of `repeat` runs in seconds.
+    Returns a JSON serializable dictionary, to compare with `compare_suites`.
+    '''
+    results = []
+    for name, (case, uses_depth) in SUITE.items():
+        if cases and name not in cases:
+            continue
+        for width in widths:
+            for depth in (depths if uses_depth else [None]):
+                func = case(width, depth)
+                times = []
+                for _ in range(repeat):
+                    gc.collect()
+                    start = time.perf_counter()
+                    func()
+                    times.append(time.perf_counter() - start)
+                results.append({'case': name, 'width': width, 'depth': depth, 'min': min(times), 'median': statistics.median(times)})
+
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare_suites(previous, current):
+    '''
+    (case, width, depth, previous min, current min) for the results of both suites
+    '''
+    previous = {(r['case'], r['width'], r['depth']): r['min'] for r in previous['results']}
+    return [
+        (r['case'], r['width'], r['depth'], previous[(r['case'], r['width'], r['depth'])], r['min'])
+        for r in current['results'] if (r['case'], r['width'], r['depth']) in previous
+    ]
+
+
+def print_suite(suite, previous=None):
+    print(f"Suite (commit {suite['commit']}, python {suite['python']}, best of {suite['repeat']}):")
+    for r in suite['results']:
+        print(f"  {r['case']:<16} width={r['width']:<7} depth={str(r['depth']):<5} {r['min'] * 1000:10.2f} ms (median {r['median'] * 1000:.2f} ms)")
+
+    if previous is not None:
+        print(f"Compared to commit {previous['commit']}:")
+        for case, width, depth, before, after in compare_suites(previous, suite):
+            print(f"  {case:<16} width={width:<7} depth={str(depth):<5} {before * 1000:10.2f} ms -> {after * 1000:10.2f} ms ({after / before - 1:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='InNOut benchmarks')
+    parser.add_argument('--width', type=int, default=10000, help='number of elements in the matched lists')
+    parser.add_argument('--rows', type=int, default=0, help='number of rows of the QuerySet benchmark, requires Django')
+    parser.add_argument('--chunk-size', type=int, default=2000, help='chunk size of the QuerySet benchmark')
+    parser.add_argument('--importtime', action='store_true', help='measure the import time of the package')
+    parser.add_argument('--suite', action='store_true', help='run the timing suite instead of the memory benchmarks')
+    parser.add_argument('--widths', default='100,1000', help='comma separated widths of the suite documents')
+    parser.add_argument('--depths', default='1,3', help='comma separated depths of the suite documents')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each suite case')
+    parser.add_argument('--cases', help=f"comma separated cases of the suite to run, among {', '.join(SUITE)}")
+    parser.add_argument('--output', help='write the suite results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of a previous suite run to compare with')
+    args = parser.parse_args()
+
+    if args.suite:
+        suite = run_suite(
+            [int(w) for w in args.widths.split(',')],
+            [int(d) for d in args.depths.split(',')],
+            args.repeat,
+            args.cases.split(',') if args.cases else None,
+        )
+        previous = None
+        if args.compare:
+            with open(args.compare) as f:
+                previous = json.load(f)
+        print_suite(suite, previous)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(suite, f, indent=2)
+        return
+
+    memory = bench_store_memory(args.width)
+    print(f"Store memory for {args.width} profiles:")
+    for name in ('default', 'compact'):
+        print(f"  {name:<8} {memory[name]['current'] / 1024:10.1f} KiB (peak {memory[name]['peak'] / 1024:.1f} KiB)")
+    print(f"  reduction {memory['reduction']:.1%}")
+
+    if args.rows:
+        memory = bench_queryset_memory(args.rows, args.chunk_size)
+        print(f"QuerySet memory for {args.rows} rows:")
+        for name in ('cached', 'chunked'):
+            print(f"  {name:<8} {memory[name]['current'] / 1024:10.1f} KiB (peak {memory[name]['peak'] / 1024:.1f} KiB)")
+        print(f"  peak reduction {memory['reduction']:.1%}")
+
+    if args.importtime:
+        print("Import time:")
+        for module in (__package__, 'pydash', 'django.db.models'):
+            try:
+                print(f"  {module:<16} {bench_import_time(module) / 1000:8.1f} ms")
+            except subprocess.CalledProcessError:
+                print(f"  {module:<16} not installed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+from . import S, Trans, MatchTrans, FormatTrans
+
+# Kind of a compiled node
+SIGNAL = 'signal'
+TRANS = 'trans'
+DICT = 'dict'
+RECORD = 'record'
+LIST = 'list'
+NOTHING = 'nothing'
+
+
+class TemplateMutatedException(Exception):
+    pass
+
+
+class MatchNode():
+    '''
+    One node of a compiled match template.
+    Everything the matcher needs to know about the template at that position is resolved at compile time,
+    so matching only has to dispatch on `kind`.
+    '''
+
+    def __init__(self, kind, path, template):
+        '''
+        kind: one of SIGNAL, TRANS, DICT, LIST, NOTHING
+        path: path of the node in the template (used for debugging)
+        template: original template element
+        key: signal key (SIGNAL)
+        trans: MatchTrans to run (TRANS)
+        local: matching the node can add values to the store it is matched with (SIGNAL, TRANS, DICT)
+        on_none: run the MatchTrans even when there is no data (TRANS)
+        guards: (key, static value) list that must match the data before extracting (DICT)
+        children: (key, MatchNode) list (DICT)
+        keys: key -> MatchNode, or None for static guards, for all the keys of the template, in template order (DICT)
+        elements: MatchNode list, one for each element of the template list (LIST)
+        '''
+        self.kind = kind
+        self.path = path
+        self.template = template
+        self.key = None
+        self.trans = None
+        self.local = kind in (SIGNAL, TRANS)
+        self.on_none = True
+        self.guards = []
+        self.children = []
+        self.keys = {}
+        self.elements = []
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.kind}, {self.path})"
+
+
+class FormatNode():
+    '''
+    One node of a compiled format template.
+    The state a node is formatted with (want_return, search_deep) only depends on its position in the template,
+    so it is resolved at compile time with everything else. Only the store changes while formatting.
+    '''
+
+    def __init__(self, kind, path, template, want_return, search_deep):
+        '''
+        kind: one of SIGNAL, TRANS, DICT, RECORD, LIST, NOTHING
+        path: path of the node in the template (used for debugging)
+        template: original template element, returned as is for NOTHING
+        want_return: 'single' or 'list'
+        search_deep: bool
+        signal: S to get the value of (SIGNAL)
+        trans: FormatTrans to run (TRANS)
+        inner: FormatNode of the FormatTrans template (TRANS)
+        signals: S list used to find the deepest stores (DICT)
+        items: (key, FormatNode) list, nested dictionaries are RECORD nodes (DICT, RECORD)
+        elements: FormatNode list, one for each element of the template list (LIST)
+        '''
+        self.kind = kind
+        self.path = path
+        self.template = template
+        self.want_return = want_return
+        self.search_deep = search_deep
+        self.signal = None
+        self.trans = None
+        self.inner = None
+        self.signals = []
+        self.items = []
+        self.elements = []
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.kind}, {self.path})"
+
+
+class CompiledTemplate():
+    '''
+    A template compiled once, to be run against many data objects.
+    The template is never inspected again while matching or formatting, and is treated as immutable: it isn't copied.
+    With `fingerprint`, set by `InNOut.compile`, `check` detects if it was mutated after being compiled.
+    Match and format plans are only compiled when first needed, as a template is often used for one of them only.
+
+    >>> compiled = InNOut.compile(template)
+    >>> for data in payloads:
+    ...     transform(data, compiled, compiled_format_template)
+    '''
+
+    def __init__(self, template, list_like=(list, tuple), fingerprint=False):
+        self.template = template
+        self.list_like = list_like
+        self.non_static = (S, dict, Trans, MatchTrans, FormatTrans) + list_like
+        self.__match_plan = None
+        self.__format_plan = None
+        self.__fingerprint = self.__take_fingerprint() if fingerprint else None
+
+    def __getstate__(self):
+        # The fingerprint holds ids, that are not the same once unpickled, it is taken again by `__setstate__`
+        state = self.__dict__.copy()
+        state['_CompiledTemplate__fingerprint'] = self.__fingerprint is not None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__fingerprint = self.__take_fingerprint() if self.__fingerprint else None
+
+    def __take_fingerprint(self):
+        '''
+        Identity of every object of the template, and the keys, length and attributes of the containers holding them.
+        '''
+        fingerprint = []
+        stack = [self.template]
+        while stack:
+            value = stack.pop()
+            fingerprint.append(id(value))
+            if isinstance(value, dict):
+                fingerprint.append(tuple(value))
+                stack.extend(value.values())
+            elif isinstance(value, self.list_like):
+                fingerprint.append(len(value))
+                stack.extend(value)
+            elif isinstance(value, S):
+                fingerprint.append(value.key)
+            elif isinstance(value, Trans):
+                stack += [value.template, value.match, value.format]
+            elif isinstance(value, (MatchTrans, FormatTrans)):
+                fingerprint += [id(value.func), value.strict]
+                stack.append(value.template)
+        return fingerprint
+
+    def check(self):
+        '''
+        Raise TemplateMutatedException if the template was mutated since it was compiled.
+        Templates compiled without fingerprint are never checked.
+        '''
+        if self.__fingerprint is not None and self.__take_fingerprint() != self.__fingerprint:
+            raise TemplateMutatedException(f"Template was mutated after being compiled, compile it again. template={self.template}")
+
+    @property
+    def match_plan(self):
+        if self.__match_plan is None:
+            self.__match_plan = self.compile_match(self.template, 'root')
+        return self.__match_plan
+
+    @property
+    def format_plan(self):
+        if self.__format_plan is None:
+            self.__format_plan = self.compile_format(self.template, 'root', 'single', True)
+        return self.__format_plan
+
+    def __next_path(self, path, key):
+        if path == '' or path == None:
+            return key
+        else:
+            return f"{path}.{key}"
+
+    def is_static(self, value):
+        return not isinstance(value, self.non_static) and not callable(value)
+
+    def __open_match_node(self, template, path, unwrapped):
+        '''
+        Compile a template element. Dictionaries & lists are returned without their children, see `compile_match`.
+        '''
+        if isinstance(template, MatchTrans) or isinstance(template, Trans):
+            trans = template.match if isinstance(template, Trans) else template
+            if trans is None:
+                # Trans without match function does nothing while matching
+                return MatchNode(NOTHING, path, template)
+
+            node = MatchNode(TRANS, path, template)
+            node.trans = trans
+            # The inner template of a FormatTrans is only matched when there is data
+            node.on_none = not unwrapped
+            return node
+
+        if isinstance(template, FormatTrans) and not unwrapped:
+            return self.__open_match_node(template.template, path, True)
+
+        if isinstance(template, S):
+            node = MatchNode(SIGNAL, path, template)
+            node.key = template.key
+            return node
+
+        if isinstance(template, dict):
+            return MatchNode(DICT, path, template)
+
+        if isinstance(template, self.list_like):
+            return MatchNode(LIST, path, template)
+
+        return MatchNode(NOTHING, path, template)
+
+    def __template_items(self, node):
+        if node.kind == DICT:
+            return iter(node.template.items())
+        return ((str(idx), element) for idx, element in enumerate(node.template))
+
+    def __add_match_child(self, node, key, child):
+        if node.kind == DICT:
+            if child.kind != NOTHING:
+                node.children.append((key, child))
+                node.keys[key] = child
+                node.local = node.local or child.local
+        elif child.local:
+            node.elements.append(child)
+
+    def compile_match(self, template, path, unwrapped=False):
+        '''
+        Mirror the dispatching of `InNOut.match`.
+        `unwrapped` is set when compiling the inner template of a FormatTrans, which is only done once.
+        Nested dictionaries & lists are compiled with an explicit stack, so templates of any depth can be compiled.
+
+        Branches of the template that can't yield any signal are pruned, and compiled as NOTHING:
+        - dictionaries without signals, MatchTrans or lists yielding signals (e.g: static values only)
+        - elements of lists that can't add values to their own store, as empty stores are always dropped
+        - lists without elements left
+        '''
+        node = self.__open_match_node(template, path, unwrapped)
+        if node.kind not in (DICT, LIST):
+            return node
+
+        # (dictionary or list node, its key in the parent node, template items left to compile)
+        stack = [(node, None, self.__template_items(node))]
+        while True:
+            node, key, items = stack[-1]
+            for child_key, value in items:
+                if node.kind == DICT and self.is_static(value):
+                    node.guards.append((child_key, value))
+                    node.keys[child_key] = None
+                    continue
+
+                child = self.__open_match_node(value, self.__next_path(node.path, child_key), False)
+                if child.kind in (DICT, LIST):
+                    stack.append((child, child_key, self.__template_items(child)))
+                    break
+                self.__add_match_child(node, child_key, child)
+            else:
+                stack.pop()
+                if not node.children and not node.elements:
+                    node = MatchNode(NOTHING, node.path, node.template)
+                if not stack:
+                    return node
+                self.__add_match_child(stack[-1][0], key, node)
+
+    def __dict_signals(self, template, acc):
+        '''
+        Get a list of signals at this level, ignore list_like and FormatTrans are they are another sub-template
+        '''
+        for key, value in template.items():
+            if isinstance(value, Trans) or isinstance(value, MatchTrans) or isinstance(value, FormatTrans):
+                value = value.template
+
+            if isinstance(value, S):
+                acc.append(value)
+            elif isinstance(value, dict):
+                self.__dict_signals(value, acc)
+        return acc
+
+    def __compile_record(self, template, path):
+        '''
+        Compile the elements of a dictionary formatted for a single store.
+        Nested dictionaries are formatted with the same store.
+        '''
+        node = FormatNode(RECORD, path, template, 'single', False)
+        for key, value in template.items():
+            if isinstance(value, Trans) and not value.format or isinstance(value, MatchTrans):
+                value = value.template
+
+            next_path = self.__next_path(path, key)
+            if isinstance(value, dict):
+                node.items.append((key, self.__compile_record(value, next_path)))
+            else:
+                node.items.append((key, self.compile_format(value, next_path, 'single', False)))
+        return node
+
+    def compile_format(self, template, path, want_return, search_deep):
+        '''
+        Mirror the dispatching of `InNOut.format`.
+        '''
+        # If Trans is defined without format, take the template from the Trans.
+        # For MatchTrans, just take the template
+        if isinstance(template, Trans) and not template.format or isinstance(template, MatchTrans):
+            template = template.template
+
+        if isinstance(template, S):
+            node = FormatNode(SIGNAL, path, template, want_return, search_deep)
+            node.signal = template
+            return node
+
+        if isinstance(template, FormatTrans) or isinstance(template, Trans):
+            node = FormatNode(TRANS, path, template, want_return, search_deep)
+            node.trans = template.format if isinstance(template, Trans) else template
+            node.inner = self.compile_format(node.trans.template, path, 'single', True)
+            return node
+
+        if isinstance(template, dict):
+            node = FormatNode(DICT, path, template, want_return, search_deep)
+            node.signals = self.__dict_signals(template, [])
+            node.items = self.__compile_record(template, path).items
+            return node
+
+        if isinstance(template, self.list_like):
+            node = FormatNode(LIST, path, template, want_return, search_deep)
+            node.elements = [
+                self.compile_format(element, self.__next_path(path, str(idx)), 'list', True)
+                for idx, element in enumerate(template)
+            ]
+            return node
+
+        return FormatNode(NOTHING, path, template, want_return, search_deep)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.template})"
@@ -0,0 +1,144 @@
+import contextlib
+import csv
+import gzip
+import io
+import json
+import os
+
+from . import Trans, MatchTrans, CompiledTemplate
+
+# Rows written at once
+BUFFER_SIZE = 1000
+
+
+@contextlib.contextmanager
+def _text_stream(file, compress):
+    '''
+    Text stream writing to `file`: a path, a text file like object or a binary file like object.
+    Paths ending with `.gz` are compressed unless compress is False. Text file like objects can't be compressed.
+    File like objects are left open.
+    '''
+    if isinstance(file, (str, os.PathLike)):
+        if compress is None:
+            compress = os.fspath(file).endswith('.gz')
+        with open(file, 'wb') as raw:
+            with _text_stream(raw, compress) as stream:
+                yield stream
+        return
+
+    if isinstance(file, io.TextIOBase):
+        if compress:
+            raise ValueError("Can't compress to a text file, use a binary file or a path")
+        yield file
+        return
+
+    compressed = gzip.GzipFile(fileobj=file, mode='wb') if compress else None
+    stream = io.TextIOWrapper(compressed or file, encoding='utf-8', newline='')
+    try:
+        yield stream
+    finally:
+        stream.flush()
+        # Don't close the file of the caller with the wrapper
+        stream.detach()
+        if compressed:
+            compressed.close()
+
+
+def _write_buffered(stream, lines, buffer_size):
+    buffer = []
+    count = 0
+    for line in lines:
+        buffer.append(line)
+        count += 1
+        if len(buffer) >= buffer_size:
+            stream.write(''.join(buffer))
+            buffer = []
+    if buffer:
+        stream.write(''.join(buffer))
+    return count
+
+
+def template_columns(template):
+    '''
+    Columns of the rows formatted by a template: keys of the dictionaries of a list template, or of a dictionary template,
+    in template order. Keys of nested dictionaries are paths, e.g: ('address', 'street').
+    '''
+    if isinstance(template, CompiledTemplate):
+        template = template.template
+    elements = template if isinstance(template, (list, tuple)) else [template]
+
+    columns = []
+
+    def add_columns(template, path):
+        for key, value in template.items():
+            # Same unwrapping as `CompiledTemplate.compile_format`
+            if isinstance(value, Trans) and not value.format or isinstance(value, MatchTrans):
+                value = value.template
+            if isinstance(value, dict):
+                add_columns(value, path + (key,))
+            elif path + (key,) not in columns:
+                columns.append(path + (key,))
+
+    for element in elements:
+        if isinstance(element, Trans) and not element.format or isinstance(element, MatchTrans):
+            element = element.template
+        if not isinstance(element, dict):
+            raise ValueError(f"Rows must be formatted as dictionaries to get their columns. template={template}")
+        add_columns(element, ())
+    return columns
+
+
+def write_ndjson(file, template, match_obj, deepclean=False, compress=None, buffer_size=BUFFER_SIZE):
+    '''
+    Write the rows formatted by the template, one JSON document by line. Rows are formatted one at a time with `iter_format`.
+    Values that aren't JSON serializable (e.g: dates, decimals) are written as strings.
+    Returns the number of rows written.
+
+    file: path, or text or binary file like object
+    compress: gzip the output. Default to True for paths ending with `.gz`
+    buffer_size: number of rows written at once
+    '''
+    rows = match_obj.iter_format(template, deepclean=deepclean)
+    lines = (json.dumps(row, default=str, ensure_ascii=False) + '\n' for row in rows)
+    with _text_stream(file, compress) as stream:
+        return _write_buffered(stream, lines, buffer_size)
+
+
+def write_csv(file, template, match_obj, deepclean=False, compress=None, buffer_size=BUFFER_SIZE, header=True):
+    '''
+    Write the rows formatted by the template as CSV, check `write_ndjson`.
+    Columns are the keys of the template (see `template_columns`), nested dictionaries keys are joined with a dot.
+    Missing values are empty, lists and dictionaries are written as JSON.
+    '''
+    if not isinstance(template, CompiledTemplate):
+        template = CompiledTemplate(template, match_obj.list_like)
+    columns = template_columns(template)
+
+    def value(row, path):
+        for key in path:
+            if not isinstance(row, dict):
+                return None
+            row = row.get(key)
+        if isinstance(row, (list, tuple, dict)):
+            return json.dumps(row, default=str, ensure_ascii=False)
+        return row
+
+    line = io.StringIO()
+    writer = csv.writer(line)
+
+    def to_line(values):
+        line.seek(0)
+        line.truncate()
+        writer.writerow(values)
+        return line.getvalue()
+
+    def lines():
+        if header:
+            yield to_line(['.'.join(str(key) for key in path) for path in columns])
+        for row in match_obj.iter_format(template, deepclean=deepclean):
+            if not isinstance(row, dict):
+                raise ValueError(f"Rows must be dictionaries to be written as CSV. row={row}")
+            yield to_line([value(row, path) for path in columns])
+
+    with _text_stream(file, compress) as stream:
+        return _write_buffered(stream, lines(), buffer_size) - (1 if header else 0)
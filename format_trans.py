@@ -1,6 +1,4 @@
-import logging
-
-logger = logging.getLogger('in_n_out')
+from .log import logger, debug
 
 class FormatTrans():
     def __init__(self, template, func, strict=False, debug=False):
@@ -9,25 +7,23 @@ class FormatTrans():
         self.strict = strict
         self.debug_log = debug
 
-    def __debug(self, s):
-        if self.debug_log:
-            print(f"FormatTrans: {s}")
-        logger.debug(s)
+    def __debug(self, debug_log, s, *args):
+        debug("FormatTrans", debug_log, s, *args)
 
     def transform(self, get_sub_template, debug=None, dir=None):
-        if debug:
-            self.debug_log = True
+        # The template may be shared by many formats, only log for this call
+        debug_log = self.debug_log or bool(debug)
 
         params = get_sub_template(self.template)
 
-        self.__debug(f"Running transform function. function={self.func} template={self.template}, params={params}")
+        self.__debug(debug_log, "Running transform function. function=%s template=%s, params=%s", self.func, self.template, params)
         try:
             result = self.func(params)
-            self.__debug(f"Successfully ran transform function. result={result}, function={self.func} template={self.template}, params={params}")
+            self.__debug(debug_log, "Successfully ran transform function. result=%s, function=%s template=%s, params=%s", result, self.func, self.template, params)
             return result
         except Exception as e:
             if self.strict:
                 raise e
             else:
-                logger.warning(f"Error raised during transformation: error={e}, function={self.func} template={self.template}, params={params}")
+                logger.warning("Error raised during transformation: error=%s, function=%s template=%s, params=%s", e, self.func, self.template, params)
                 return
@@ -1,41 +1,62 @@
-import copy
-import logging
-from pydash import _
+import sys
 
-try:
-    from django.db.models import QuerySet
-    django_installed = True
-except ModuleNotFoundError:
-    # default QuerySet matching to list
-    QuerySet = list
-    django_installed = False
+from . import Store, CompactStore, S, Trans, MatchTrans, FormatTrans
+from .store import SignalMemo
+from .log import logger, debug
+from .compiled_template import CompiledTemplate, MatchNode, SIGNAL, TRANS, DICT, RECORD, LIST
+from .orm import prefetch_queryset, project_queryset
 
-from . import Store, S, Trans, MatchTrans, FormatTrans
 
-logger = logging.getLogger('in_n_out')
+# Set by `detect_django`. Django is never imported by the package itself, so importing it stays cheap without Django.
+QuerySet = None
 
-class IncorrecTypeException(Exception):
-    pass
 
+def detect_django():
+    '''
+    Support QuerySet once the application imported Django models: QuerySet is then added to `InNOut.list_like`.
+    Data can only hold QuerySet after that, so checking before matching is enough.
+    Returns whether Django is in use.
+    '''
+    global QuerySet
+    if QuerySet is None and 'django.db.models' in sys.modules:
+        from django.db.models import QuerySet
+        InNOut.list_like = InNOut.list_like + (QuerySet,)
+        InNOut.non_static = InNOut.non_static + (QuerySet,)
+    return QuerySet is not None
 
-class State():
-    def __init__(self, path, search_deep, want_return, store):
-        self.path = path
-        self.search_deep = search_deep
-        self.want_return = want_return
-        self.store = store
+
+class IncorrecTypeException(Exception):
+    pass
 
 
 class InNOut():
-    list_like = (list, tuple, QuerySet)
+    # QuerySet is added by `detect_django`
+    list_like = (list, tuple)
     non_static = (S, dict, Trans, MatchTrans, FormatTrans) + list_like
 
-    def __init__(self, template, data, debug=False):
-        self.template = copy.deepcopy(template)
+    def __init__(self, template, data, debug=False, compact=False, prefetch=True, project=False, chunk_size=None, check=False):
+        '''
+        compact: use `CompactStore` to hold the matched values, to reduce memory usage on large matches
+        prefetch: select & prefetch on QuerySet the relations used by the template, check `orm.prefetch_queryset`
+        project: also restrict the columns fetched by QuerySet to the ones used by the template, check `orm.project_queryset`
+        chunk_size: iterate QuerySet by chunks of rows with `QuerySet.iterator`, instead of caching all their rows,
+                    when the template visits each row once. Relations are then prefetched for each chunk
+        check: raise TemplateMutatedException if the compiled template was mutated after `compile`, check `CompiledTemplate.check`
+        '''
+        self.django = detect_django()
+        template = self.__compiled(template, check)
+        self.compiled = template
+        self.template = template.template
         self.data = data
         self.debug_log = debug
+        self.store_class = CompactStore if compact else Store
+        self.prefetch = prefetch
+        self.project = project
+        self.chunk_size = chunk_size
+        # Lookups of signal values in the memo of the last format pass, check `SignalMemo.stats`
+        self.format_stats = None
         self.root_store = self.__new_store(None)
-        self.match(self.template, self.data, 'root', self.root_store)
+        self.match_root(self.data)
 
     def __next_path(self, path, key):
         if path == '' or path == None:
@@ -43,308 +64,447 @@ class InNOut():
         else:
             return f"{path}.{key}"
 
-    def __is_non_static(self, value):
-        return isinstance(value, self.non_static) or callable(value)
+    def __compiled(self, template, check):
+        '''
+        Templates that aren't compiled are compiled for this use only, without fingerprint.
+        '''
+        if not isinstance(template, CompiledTemplate):
+            return CompiledTemplate(template, self.list_like)
+        if check:
+            template.check()
+        return template
 
     def __new_store(self, current_store):
-        return Store(current_store)
+        return self.store_class(current_store)
 
-    def __debug(self, s):
-        if self.debug_log:
-            print(f"{self.__class__.__name__}: {s}")
-        logger.debug(s)
+    def __debug(self, s, *args):
+        debug(self.__class__.__name__, self.debug_log, s, *args)
 
     def __clean(self, result, deepclean=False):
-        if isinstance(result, InNOut.list_like):
-            l = []
-            for x in result:
-                x = self.__clean(x, deepclean)
-                if x is not None:
-                    l.append(x)
-            if deepclean and l == []:
-                return None
-            return l
-        elif isinstance(result, dict):
-            d = {}
-            for k, v in result.items():
-                v = self.__clean(v, deepclean)
-                if v is not None:
-                    d[k] = v
-            if deepclean and d == {}:
-                return None
-            return d
-        else:
+        '''
+        Remove the None values of the lists & dictionaries of the result, and the empty ones when deepclean.
+        Nested lists & dictionaries are cleaned with an explicit stack, so results of any depth can be cleaned.
+        '''
+        containers = InNOut.list_like + (dict,)
+        if not isinstance(result, containers):
             return result
 
+        def frame(value, key):
+            # (items left to clean, cleaned container, key of the container in its parent)
+            if isinstance(value, dict):
+                return iter(value.items()), {}, key
+            return iter(enumerate(value)), [], key
+
+        def add(container, key, value):
+            if isinstance(container, dict):
+                container[key] = value
+            else:
+                container.append(value)
+
+        stack = [frame(result, None)]
+        while True:
+            items, cleaned, key = stack[-1]
+            for k, v in items:
+                if isinstance(v, containers):
+                    stack.append(frame(v, k))
+                    break
+                if v is not None:
+                    add(cleaned, k, v)
+            else:
+                stack.pop()
+                if deepclean and not cleaned:
+                    cleaned = None
+                if not stack:
+                    return cleaned
+                if cleaned is not None:
+                    add(stack[-1][1], key, cleaned)
+
 
     ###########
     # MATCHING
     ###########
 
-    def __match_list(self, template_list, data_list, path, current_store):
+    def __list_elements(self, node, data_list, current_store):
+        '''
+        Yield the (node, data, store) to match for each element of the list, check `__run`.
+        '''
         # To handle xmltodict, if the template request a list, but the data isn't one,
         # make the data the only element in the list
         if not isinstance(data_list, self.list_like):
             data_list = [data_list]
 
-        for idx, template in enumerate(template_list):
-            for data in data_list:
-                self.match(
-                    template,
-                    data,
-                    self.__next_path(path, str(idx)),
-                    self.__new_store(current_store)
-                )
-        # When no processing happen (e.g: static matching), the store will be empty
+        # Avoid N+1 queries on QuerySet not evaluated yet. QuerySet of prefetched relations are already evaluated.
+        if self.django and isinstance(data_list, QuerySet) and data_list._result_cache is None:
+            if self.project:
+                data_list = project_queryset(node, data_list)
+            elif self.prefetch:
+                data_list = prefetch_queryset(node, data_list)
+            # Rows are only visited once by a single template, they don't need to be held for the whole match
+            if self.chunk_size and len(node.elements) == 1:
+                data_list = data_list.iterator(chunk_size=self.chunk_size)
+
+        # When several templates match the same data, share the elements already resolved on each data
+        if len(node.elements) > 1:
+            data_list = list(data_list)
+            caches = [{} for data in data_list]
+        else:
+            caches = None
+
+        for element in node.elements:
+            for idx, data in enumerate(data_list):
+                # Don't create stores for data that won't be extracted, they would be empty
+                if element.kind == DICT:
+                    cache = caches[idx] if caches else {}
+                    if data is not None and self.__can_extract(element, data, cache):
+                        yield from self.__dict_children(element, data, self.__new_store(current_store), cache)
+                elif data is not None or element.kind == TRANS and element.on_none:
+                    yield element, data, self.__new_store(current_store)
+        # When no processing happen (e.g: no data for the signals), the store will be empty
         # clean empty store created.
-        current_store.children = _.filter(current_store.children, lambda x: bool(x.values))
-
-    def __match_dict(self, template, data, path, store):
-        def get_data_element(data, key):
-            def is_relationship_manager(el):
-                return django_installed and el.__class__.__name__ == 'RelatedManager' and hasattr(el, 'all')
-
-            if isinstance(data, dict):
-                return data.get(key)
-            elif isinstance(data, self.list_like):
-                logger.warning(f"Matching template is a dictionary but data is a list. Taking first element of the list. It is advised to fix these. path={path} key={key}")
-                return get_data_element(data[0], key) if len(data) > 0 else None
-            else:
-                if hasattr(data, key):
-                    el = getattr(data, key)
-                    if is_relationship_manager(el):
-                        return el.all()
-                    elif callable(el):
-                        return el()
-                    else:
-                        return el
-
-        def can_extract(template, data, path):
-            '''
-            The function will look at the current depth, and check if there is any static values that
-            needs to be present before allowing the extraction of signals.
-            That allows for { 'users': [ { 'username': 'brian', email: S('email')} ] }. Only extract for `username == 'brian'`
-            '''
-            for key, value in template.items():
-                if not self.__is_non_static(value) and value != get_data_element(data, key):
-                    self.__debug(f"Cannot extract data {value} of type {type(value)} is static and not equal to {get_data_element(data, key)}, path={path}")
-                    return False
+        current_store.remove_empty_children()
+
+    def __get_raw_element(self, data, key, path):
+        '''
+        Get the element of the data for key, without calling it.
+        Returns (element, call). When call is set, the element is call()
+        '''
+        def is_relationship_manager(el):
+            return self.django and el.__class__.__name__ == 'RelatedManager' and hasattr(el, 'all')
+
+        if isinstance(data, dict):
+            return data.get(key), None
+        elif isinstance(data, self.list_like):
+            logger.warning("Matching template is a dictionary but data is a list. Taking first element of the list. It is advised to fix these. path=%s key=%s", path, key)
+            return self.__get_raw_element(data[0], key, path) if len(data) > 0 else (None, None)
+        else:
+            if hasattr(data, key):
+                el = getattr(data, key)
+                if is_relationship_manager(el):
+                    return None, el.all
+                elif callable(el):
+                    return None, el
+                else:
+                    return el, None
+            return None, None
+
+    def __get_data_element(self, data, key, path, cache):
+        '''
+        Get the element of the data for key. Each key is resolved once, and kept in the cache of the data.
+        '''
+        if key in cache:
+            return cache[key]
+        element, call = self.__get_raw_element(data, key, path)
+        if call is not None:
+            element = call()
+        cache[key] = element
+        return element
+
+    def __can_extract(self, node, data, cache):
+        '''
+        The function will look at the current depth, and check if there is any static values that
+        needs to be present before allowing the extraction of signals.
+        That allows for { 'users': [ { 'username': 'brian', email: S('email')} ] }. Only extract for `username == 'brian'`
+
+        Static values needing a call (callables, RelatedManager) are checked last, so plain values can reject the data first.
+        '''
+        def check(value, element):
+            if value != element:
+                self.__debug("Cannot extract data %s of type %s is static and not equal to %s, path=%s", value, type(value), element, node.path)
+                return False
             return True
 
-        if not can_extract(template, data, path):
-            return
-
-        for key, value in template.items():
-            self.match(
-                value,
-                get_data_element(data, key),
-                self.__next_path(path, key),
-                store
-            )
+        deferred = []
+        for key, value in node.guards:
+            if key in cache:
+                element = cache[key]
+            else:
+                element, call = self.__get_raw_element(data, key, node.path)
+                if call is not None:
+                    deferred.append((key, value, call))
+                    continue
+                cache[key] = element
+            if not check(value, element):
+                return False
+
+        for key, value, call in deferred:
+            element = cache[key] = call()
+            if not check(value, element):
+                return False
+        return True
+
+    def __dict_children(self, node, data, store, cache):
+        '''
+        Yield the (node, data, store) to match for each child of the dictionary, check `__run`.
+        '''
+        for key, child in node.children:
+            yield child, self.__get_data_element(data, key, node.path, cache), store
+
+    def __run(self, node, data, store):
+        '''
+        Run a compiled match node against the data.
+        Dictionaries and lists push the generator of their children on a stack instead of recursing,
+        so documents of any depth can be matched. Children are matched depth first, in the template order.
+        '''
+        stack = [iter(((node, data, store),))]
+        while stack:
+            item = next(stack[-1], None)
+            if item is None:
+                stack.pop()
+                continue
+
+            node, data, store = item
+            kind = node.kind
+            if kind == TRANS and (node.on_none or data is not None):
+                self.__debug("Matching MatchTrans value=%s, path=%s", data, node.path)
+                node.trans.transform(
+                    data,
+                    store,
+                    dir='match',
+                    debug=self.debug_log,
+                )
+            elif data is None:
+                self.__debug("No data available for matching, path=%s", node.path)
+            elif kind == SIGNAL:
+                self.__debug("Matching value signal=%s value=%s, path=%s", node.key, data, node.path)
+                store.add(node.key, data)
+            elif kind == DICT:
+                self.__debug("Matching dict path=%s", node.path)
+                cache = {}
+                if self.__can_extract(node, data, cache):
+                    stack.append(self.__dict_children(node, data, store, cache))
+            elif kind == LIST:
+                self.__debug("Matching list path=%s", node.path)
+                stack.append(self.__list_elements(node, data, store))
+            else:
+                self.__debug("Matching Nothing value=%s type = %s, path=%s", node.template, type(node.template), node.path)
 
+    def match_root(self, data):
+        '''
+        Match the data against the whole template, filling the root store.
+        '''
+        self.__run(self.compiled.match_plan, data, self.root_store)
 
     def match(self, template, data, path, store):
-        if isinstance(template, MatchTrans) or isinstance(template, Trans):
-            self.__debug(f"Matching MatchTrans value={data}, path={path}")
-            template.transform(
-                data,
-                store,
-                dir='match',
-                debug=self.debug_log,
-            )
-            return
-
-        if data is None:
-            self.__debug(f"No data available for matching, path={path}")
-            return
-
-        # If Trans is defined without match, take the template from the Trans.
-        # For FormatTrans, just take the template
-        if isinstance(template, Trans) and not template.match or isinstance(template, FormatTrans):
-            self.__debug(f"Found FormatTrans. Using inner template. value={data}, path={path}")
-            template = template.template
-
-        if isinstance(template, S):
-            self.__debug(f"Matching value signal={template.key} value={data}, path={path}")
-            store.add(template.key, data)
-
-        elif isinstance(template, MatchTrans) or isinstance(template, Trans):
-            self.__debug(f"Matching MatchTrans value={data}, path={path}")
-            template.transform(
-                data,
-                store,
-                dir='match',
-                debug=self.debug_log,
-            )
-        elif isinstance(template, dict):
-            self.__debug(f"Matching dict path={path}")
-            self.__match_dict(
-                template,
-                data,
-                path,
-                store,
-            )
-        elif isinstance(template, self.list_like):
-            self.__debug(f"Matching list path={path}")
-            self.__match_list(
-                template,
-                data,
-                path,
-                store
-            )
-        else:
-            self.__debug(f"Matching Nothing value={template} type = {type(template)}, path={path}")
+        if not isinstance(template, MatchNode):
+            template = CompiledTemplate(template, self.list_like).compile_match(template, path)
+        self.__run(template, data, store)
+
+    @classmethod
+    def compile(cls, template):
+        '''
+        Compile a match template once, to be reused with many data.
+        The result can be used everywhere a template is expected. Its fingerprint is taken to check later that it
+        wasn't mutated, with `check=True` or once per batch by `match_many`, `transform_many` and `transform_parallel`.
+        '''
+        detect_django()
+        return CompiledTemplate(template, cls.list_like, fingerprint=True)
 
 
     #############
     # FORMATTING
     #############
 
-    def __proceed_format_dict(self, format_template, state, deepest_stores):
-        def proceed_single_elements(store, result_dict, template):
-            for key, template in template.items():
-                if isinstance(template, Trans) and not template.format or isinstance(template, MatchTrans):
-                    template = template.template
-
-                if isinstance(template, dict):
-                    result_dict[key] = proceed_single_elements(store, {}, template)
+    def __iter_rows(self, node, row_stores, memo, clean, deepclean):
+        '''
+        Yield one record for each store of the row set of a dict node, see `__format_dict`.
+        Signals of the records are read directly from the row store, or the scope of its parent for inherited values,
+        as done by `Store.get_signal_value(signal, search_deep=False)`. Other items are formatted with the row store.
+        '''
+        containers = InNOut.list_like + (dict,)
+
+        def build_record(store, items, inherited):
+            values = store.values
+            result_dict = {}
+            for key, item in items:
+                kind = item.kind
+                if kind == SIGNAL:
+                    value = values.get(item.signal.key)
+                    if value is None:
+                        if inherited is None:
+                            inherited = store.parent.scope if store.parent else {}
+                        value = inherited.get(item.signal.key)
+                    if isinstance(value, list):
+                        raise IncorrecTypeException(f"Incorrect type requested. Requested non list value, but list returned. signal={item.signal} path={item.path}")
+                    if clean and isinstance(value, containers):
+                        value = self.__clean(value, deepclean)
+                elif kind == RECORD:
+                    value = build_record(store, item.items, inherited)
                 else:
-                    next_state = State(
-                        path=self.__next_path(state.path, key),
-                        search_deep=False,
-                        want_return='single',
-                        store=store,
-                    )
-                    result_dict[key] = self.__format(
-                        template,
-                        next_state,
-                    )
+                    value = self.__format(item, store, memo, clean, deepclean)
+                if value is not None or not clean:
+                    result_dict[key] = value
+            if clean and deepclean and not result_dict:
+                return None
             return result_dict
 
+        # Records are never empty before cleaning when the template has items
+        if node.items:
+            self.__debug("Format rows=%s, path=%s", len(row_stores), node.path)
+            for store in row_stores:
+                result_dict = build_record(store, node.items, None)
+                if result_dict is not None:
+                    yield result_dict
 
-        result_list = []
-        for store in deepest_stores:
-            result_dict = proceed_single_elements(store, {}, format_template)
-
-            if result_dict:
-                result_list.append(result_dict)
 
-        return result_list
-
-
-    def __format_dict(self, format_template, state):
-        def get_dict_signals(d, acc=[]):
-            '''
-            Get a list of signals at this level, ignore list_like and FormatTrans are they are another sub-template
-            The goal here is to complete all these signals in __proceed_format_dict
-            '''
-            for k, template in d.items():
-                if isinstance(template, Trans) or isinstance(template, MatchTrans) or isinstance(template, FormatTrans):
-                    template = template.template
-
-                if isinstance(template, S):
-                    acc.append(template)
-                elif isinstance(template, dict):
-                    acc = get_dict_signals(template, acc)
-
-            return acc
-
-        signals = get_dict_signals(format_template)
-        stores = state.store.get_deepest_stores_for_signals(signals)
+    def __format_dict(self, node, store, memo, clean, deepclean):
+        '''
+        Returns (result, whether the result was not empty before cleaning)
+        '''
+        # The signals of the dict are gathered at compile time, see `CompiledTemplate.compile_format`.
+        # The deepest stores having them are the row set of the dict: one record is built for each of them in __iter_rows
+        signals = node.signals
+        stores = store.get_deepest_stores_for_signals(signals)
 
         # If several stores are returns or not the current store (so deeper store), it means we're doing some accumulation.
         # If we are doing accumulation the user must request a want_return as list.
-        # When state.want_return == 'single', we always want to use the current store, get_deepest_stores_for_signals
+        # When want_return == 'single', we always want to use the current store, get_deepest_stores_for_signals
         # is called for handling error only
-        if state.want_return == 'single':
-            if len(stores) > 1 or (len(stores) == 1 and stores[0] != state.store):
-                raise IncorrecTypeException(f"Requested a dictionary but got a list. One of this signals {signals} is a list, but used as single variable. path={state.path}")
-
-            stores = [state.store]
-
-        res = self.__proceed_format_dict(format_template, state, stores)
-        if state.want_return == 'single':
-            return res[0] if len(res) > 0 else {}
+        if node.want_return == 'single':
+            if len(stores) > 1 or (len(stores) == 1 and stores[0] != store):
+                raise IncorrecTypeException(f"Requested a dictionary but got a list. One of this signals {signals} is a list, but used as single variable. path={node.path}")
+
+            stores = [store]
+
+        res = list(self.__iter_rows(node, stores, memo, clean, deepclean))
+        if node.want_return == 'single':
+            if res:
+                return res[0], True
+            # Without items the result is an empty dictionary, otherwise it was removed by deepclean
+            return None if clean and (deepclean or node.items) else {}, True
         else:
-            return res
-
-
-    def __format_list(self, template_list, state):
-        def proceed_single_store(result, store):
-            next_state = State(
-                path=self.__next_path(state.path, str(idx)),
-                search_deep=True,
-                want_return='list',
-                store=store,
-            )
-            v = self.__format(
-                  template,
-                  next_state
-                  )
-            if v is not None:
-                if isinstance(v, list):
-                    result += v
-                else:
-                    result.append(v)
-
-        result = []
-        for idx, template in enumerate(template_list):
-            for child_store in state.store.children:
-                proceed_single_store(result, child_store)
+            found = bool(node.items and stores)
+            if clean and deepclean and not res:
+                return None, found
+            return res, found
+
+
+    def __iter_list(self, node, store, memo, clean, deepclean, found):
+        '''
+        Yield the elements of the formatted list one at a time.
+        found[0] is set when the list is not empty before cleaning.
+        '''
+        def iter_store(element, store):
+            if element.kind == DICT:
+                # Elements of a list are always formatted as a list of records
+                stores = store.get_deepest_stores_for_signals(element.signals)
+                if element.items and stores:
+                    found[0] = True
+                yield from self.__iter_rows(element, stores, memo, clean, deepclean)
+            elif element.kind == LIST:
+                element_found = [False]
+                yield from self.__iter_list(element, store, memo, clean, deepclean, element_found)
+                found[0] = found[0] or element_found[0]
+            else:
+                # Values not built by the format (signal values, FormatTrans results, static values)
+                # are cleaned once extending/appending is decided on their raw value
+                v = self.__format(element, store, memo, False, deepclean)
+                if v is None:
+                    return
+                if not isinstance(v, list):
+                    found[0] = True
+                    v = self.__clean(v, deepclean) if clean else v
+                    if v is not None:
+                        yield v
+                    return
+                found[0] = found[0] or bool(v)
+                for x in v:
+                    x = self.__clean(x, deepclean) if clean else x
+                    if x is not None or not clean:
+                        yield x
+
+        for element in node.elements:
+            for child_store in store.children:
+                yield from iter_store(element, child_store)
 
         # # if we are not able to find anthing, we maybe trying to transpose when there is nothing to transpose.
         # # Give a chance to get the data from the current store. Check test: `test_list_no_transposition` for why this is needed.
-        if result == []:
-            for idx, template in enumerate(template_list):
-                proceed_single_store(result, state.store)
-
-        return result
-
-    def __format(self, template, state):
-        # If Trans is defined without format, take the template from the Trans.
-        # For MatchTrans, just take the template
-        if isinstance(template, Trans) and not template.format or isinstance(template, MatchTrans):
-            self.__debug(f"Found MatchTrans. Using inner template. path={state.path}")
-            template = template.template
-
-        if isinstance(template, S):
-            value = state.store.get_signal_value(template, state.search_deep)
-            self.__debug(f"Format value signal={template.key} value={value}, path={state.path}")
-            if isinstance(value, list) and state.want_return == 'single':
-                raise IncorrecTypeException(f"Incorrect type requested. Requested non list value, but list returned. signal={template} path={state.path}")
-            return value
-
-        elif isinstance(template, FormatTrans) or isinstance(template, Trans):
-            self.__debug(f"Format FormatTrans. path={state.path}")
-            next_state = State(path=state.path, store=state.store, want_return='single', search_deep=True)
-            return template.transform(
-                lambda sub_template: self.__format(sub_template, next_state),
+        if not found[0]:
+            for element in node.elements:
+                yield from iter_store(element, store)
+
+    def __format_list(self, node, store, memo, clean, deepclean):
+        '''
+        Returns (result, whether the result was not empty before cleaning)
+        '''
+        found = [False]
+        result = list(self.__iter_list(node, store, memo, clean, deepclean, found))
+        if clean and deepclean and not result:
+            return None, found[0]
+        return result, found[0]
+
+    def __format(self, node, store, memo, clean=False, deepclean=False):
+        '''
+        Format a compiled format node with the given store.
+        memo: SignalMemo of the format pass.
+        clean: remove None values, and empty lists & dictionaries when deepclean, while formatting.
+        Values are not cleaned for the parameters of FormatTrans.
+        '''
+        kind = node.kind
+        if kind == SIGNAL:
+            value = memo.get_signal_value(store, node.signal, node.search_deep)
+            self.__debug("Format value signal=%s value=%s, path=%s", node.signal.key, value, node.path)
+            if isinstance(value, list) and node.want_return == 'single':
+                raise IncorrecTypeException(f"Incorrect type requested. Requested non list value, but list returned. signal={node.signal} path={node.path}")
+
+        elif kind == TRANS:
+            self.__debug("Format FormatTrans. path=%s", node.path)
+
+            def get_sub_template(sub_template):
+                if sub_template is not node.inner.template:
+                    compiled = CompiledTemplate(sub_template, self.list_like)
+                    return self.__format(compiled.compile_format(compiled.template, node.path, 'single', True), store, memo)
+                return self.__format(node.inner, store, memo)
+
+            value = node.trans.transform(
+                get_sub_template,
                 debug=self.debug_log,
                 dir='format'
             )
 
-        elif isinstance(template, dict):
-            self.__debug(f"Format dict, path={state.path}")
-            return self.__format_dict(template, state)
+        elif kind == DICT:
+            self.__debug("Format dict, path=%s", node.path)
+            return self.__format_dict(node, store, memo, clean, deepclean)[0]
 
-        elif isinstance(template, self.list_like):
-            self.__debug(f"Format list, path={state.path}")
-            return self.__format_list(template, state)
+        elif kind == LIST:
+            self.__debug("Format list, path=%s", node.path)
+            return self.__format_list(node, store, memo, clean, deepclean)[0]
         else:
-            self.__debug(f"Nothing to format type={type(template)}, path={state.path}")
-            return template
-
-    def format(self, template, debug=None, deepclean=False):
-        state = State(
-            path='root',
-            search_deep=True,
-            want_return='single',
-            store=self.root_store,
-        )
+            self.__debug("Nothing to format type=%s, path=%s", type(node.template), node.path)
+            value = node.template
+
+        return self.__clean(value, deepclean) if clean else value
+
+    def format(self, template, debug=None, deepclean=False, check=False):
+        if debug is not None:
+            self.debug_log = debug
+        template = self.__compiled(template, check)
+        memo = SignalMemo(self.root_store)
+        try:
+            return self.__format(template.format_plan, self.root_store, memo, True, deepclean)
+        finally:
+            self.format_stats = memo.stats()
+
+    def iter_format(self, template, debug=None, deepclean=False, check=False):
+        '''
+        Same as `format`, but yield the elements of a list template one at a time instead of returning the whole list.
+        Elements are built from the stores as they are consumed, so large results can be written without being held in memory.
+        Other templates yield their formatted result, unless it was cleaned to None.
+        '''
         if debug is not None:
             self.debug_log = debug
-        template = copy.deepcopy(template)
-        return self.__clean(self.__format(template, state), deepclean)
+        template = self.__compiled(template, check)
+        memo = SignalMemo(self.root_store)
+
+        node = template.format_plan
+        try:
+            if node.kind == LIST:
+                yield from self.__iter_list(node, self.root_store, memo, True, deepclean, [False])
+            else:
+                result = self.__format(node, self.root_store, memo, True, deepclean)
+                if result is not None:
+                    yield result
+        finally:
+            self.format_stats = memo.stats()
 
     @property
     def storage(self):
@@ -352,3 +512,6 @@ class InNOut():
 
     def __str__(self):
         return str(self.matched)
+
+
+detect_django()
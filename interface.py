@@ -1,11 +1,44 @@
-from pydash import _
-from . import InNOut
+from . import InNOut, CompiledTemplate
 
-def match(template, data, debug=None):
-    return InNOut(template, data, debug)
+def compile(template):
+    return InNOut.compile(template)
+
+def match(template, data, debug=None, compact=False):
+    return InNOut(template, data, debug, compact=compact)
 
 def format(template, match_obj, debug=None, deepclean=False):
     return match_obj.format(template, debug=debug, deepclean=deepclean)
 
-def transform(data, match_template, format_template, debug=None, deepclean=False):
-    return InNOut(match_template, data, debug).format(format_template, debug=debug, deepclean=deepclean)
+def iter_format(template, match_obj, debug=None, deepclean=False):
+    return match_obj.iter_format(template, debug=debug, deepclean=deepclean)
+
+def transform(data, match_template, format_template, debug=None, deepclean=False, compact=False):
+    return InNOut(match_template, data, debug, compact=compact).format(format_template, debug=debug, deepclean=deepclean)
+
+def _compiled(template):
+    '''
+    Template of a batch: compiled, or checked once if it was compiled beforehand, instead of for each data.
+    '''
+    if isinstance(template, CompiledTemplate):
+        template.check()
+        return template
+    return InNOut.compile(template)
+
+def match_many(template, datas, debug=None, compact=False):
+    '''
+    Match every data of `datas` with the same template, compiled once.
+    Matches are yielded one by one in the order of `datas`, so only one is held in memory at a time.
+    '''
+    template = _compiled(template)
+    for data in datas:
+        yield match(template, data, debug, compact=compact)
+
+def transform_many(datas, match_template, format_template, debug=None, deepclean=False, compact=False):
+    '''
+    Transform every data of `datas` with the same templates, compiled once.
+    Results are yielded one by one in the order of `datas`, and are the same as calling `transform` for each data.
+    '''
+    match_template = _compiled(match_template)
+    format_template = _compiled(format_template)
+    for data in datas:
+        yield transform(data, match_template, format_template, debug, deepclean, compact)
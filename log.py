@@ -0,0 +1,14 @@
+import logging
+
+logger = logging.getLogger('in_n_out')
+
+
+def debug(name, debug_log, s, *args):
+    '''
+    Log a debug message, printing it as well when `debug_log` is set.
+    The message is formatted with `s % args` only when it is printed or when the logger is enabled for DEBUG,
+    so data and templates are never stringified otherwise.
+    '''
+    if debug_log:
+        print(f"{name}: {s % args}")
+    logger.debug(s, *args)
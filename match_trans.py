@@ -1,8 +1,5 @@
-import logging
-
 from . import S
-
-logger = logging.getLogger('in_n_out')
+from .log import logger, debug
 
 class IncorrectMatchTypeException(Exception):
     def __init__(self):
@@ -28,31 +25,29 @@ class MatchTrans():
         self.strict = strict
         self.debug_log = debug
 
-    def __debug(self, s):
-        if self.debug_log:
-            print(f"MatchTrans: {s}")
-        logger.debug(s)
+    def __debug(self, debug_log, s, *args):
+        debug("MatchTrans", debug_log, s, *args)
 
     def transform(self, data, store, debug=None, dir=None):
-        if debug:
-            self.debug_log = True
+        # The template may be shared by many matches, only log for this call
+        debug_log = self.debug_log or bool(debug)
 
         try:
-            self.__debug(f"Running transform function. function={self.func} template={self.template}, input data={data}")
+            self.__debug(debug_log, "Running transform function. function=%s template=%s, input data=%s", self.func, self.template, data)
             res = self.func(data)
-            self.__debug(f"Successfully ran transform function. res={res}")
+            self.__debug(debug_log, "Successfully ran transform function. res=%s", res)
         except Exception as e:
             if self.strict:
                 raise e
             else:
-                logger.warning(f"Error in MatchTrans. function={self.func} template={self.template}, input data={data}")
+                logger.warning("Error in MatchTrans. function=%s template=%s, input data=%s", self.func, self.template, data)
                 return
 
         if not isinstance(res, dict) and isinstance(self.template, dict):
             if self.strict:
                 raise MatchTransException(f"Incorrect type returned. Expecting dict. function={self.func}, function_result={res} template={self.template}, input data={data}")
             else:
-                logger.warning(f"Error in MatchTrans transform function. Incorrect type returned. Expecting dict. function={self.func}, function_result={res} template={self.template}, input data={data}")
+                logger.warning("Error in MatchTrans transform function. Incorrect type returned. Expecting dict. function=%s, function_result=%s template=%s, input data=%s", self.func, res, self.template, data)
                 return
 
         if not isinstance(res, dict):
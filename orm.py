@@ -0,0 +1,204 @@
+'''
+Django ORM helpers, deriving from a match template the relations and fields it will access on model instances.
+Only the `_meta` API of the models is used, Django is only imported to build `Prefetch` objects and to catch its errors.
+'''
+from .compiled_template import CompiledTemplate, MatchNode, DICT, LIST
+
+
+class QueryPlan():
+    '''
+    Relations and fields of a model accessed by a match template.
+    '''
+
+    def __init__(self, model):
+        '''
+        select_related: lookups of the single relations
+        prefetch_related: (lookup, QueryPlan, field) list of the multiple relations
+        fields: fields read by the template, including the ones of selected relations. None when the template
+                reads attributes that aren't fields (e.g: properties, methods), as the fields they need are unknown
+        flat: rows can be read as dictionaries with `values(*fields)`, the template only reads fields of the model
+        '''
+        self.model = model
+        self.select_related = []
+        self.prefetch_related = []
+        self.fields = []
+        self.flat = True
+
+    def lookups(self):
+        '''
+        `prefetch_related` lookups of the multiple relations, and of all the relations under them
+        '''
+        lookups = []
+        for lookup, plan, field in self.prefetch_related:
+            lookups.append(lookup)
+            lookups += [f"{lookup}__{sub_lookup}" for sub_lookup in plan.select_related + plan.lookups()]
+        return lookups
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.model.__name__}, select_related={self.select_related}, prefetch_related={self.lookups()}, fields={self.fields})"
+
+
+def relation_fields(model):
+    '''
+    Fields of the model, by the attribute name used to access them on an instance.
+    '''
+    fields = {}
+    for field in model._meta.get_fields():
+        if field.is_relation and field.related_model is None:
+            continue
+        # Reverse relations are accessed with their accessor name (related_name or `<model>_set`)
+        name = field.get_accessor_name() if field.auto_created and not field.concrete else field.name
+        if name:
+            fields[name] = field
+            if field.concrete and field.attname != name:
+                fields[field.attname] = field
+    return fields
+
+
+def _dict_keys(node):
+    '''
+    (key, MatchNode or None for static values) read on the same model instance as the node
+    '''
+    if node.kind == DICT:
+        return list(node.keys.items())
+    if node.kind == LIST:
+        return [item for element in node.elements for item in _dict_keys(element)]
+    return []
+
+
+def query_plan(node, model):
+    '''
+    Give the compiled match node of model instances (a dictionary, or a list of them for a QuerySet),
+    returns the QueryPlan of the relations and fields read by the template.
+    Single relations are selected. Multiple relations are prefetched, with their own QueryPlan.
+    '''
+    plan = QueryPlan(model)
+
+    def add_field(path):
+        if plan.fields is not None and path not in plan.fields:
+            plan.fields.append(path)
+
+    def walk(node, model, prefix):
+        fields = relation_fields(model)
+        for key, child in _dict_keys(node):
+            field = fields.get(key)
+            path = f"{prefix}{key}"
+            if field is None:
+                plan.fields = None
+                plan.flat = False
+            elif not field.is_relation or (field.concrete and key == field.attname != field.name):
+                # Foreign key ids are read without loading the relation
+                add_field(path)
+            elif field.many_to_one or field.one_to_one:
+                plan.flat = False
+                if path not in plan.select_related:
+                    plan.select_related.append(path)
+                if child is not None and child.kind in (DICT, LIST):
+                    walk(child, field.related_model, f"{path}__")
+                else:
+                    # The instance itself is used
+                    add_field(path)
+            else:
+                plan.flat = False
+                plan.prefetch_related.append((path, query_plan(child, field.related_model) if child else QueryPlan(field.related_model), field))
+
+    walk(node, model, '')
+    return plan
+
+
+def _match_node(template):
+    if isinstance(template, CompiledTemplate):
+        return template.match_plan
+    elif not isinstance(template, MatchNode):
+        return CompiledTemplate(template).match_plan
+    return template
+
+
+def _plannable(queryset):
+    '''
+    The queryset yields model instances and takes lookups. Relations can't be selected or prefetched on
+    `values()` / `values_list()` rows, nor on combined querysets (`union()`, `intersection()`, `difference()`)
+    '''
+    return queryset._fields is None and not queryset.query.combinator
+
+
+def prefetch_paths(node, model):
+    '''
+    `select_related` and `prefetch_related` lookups of the relations the compiled match node accesses on the model.
+    '''
+    plan = query_plan(node, model)
+    return plan.select_related, plan.lookups()
+
+
+def prefetch_queryset(template, queryset):
+    '''
+    Apply to the queryset the `select_related` and `prefetch_related` lookups needed by the match template,
+    so matching the queryset runs a bounded number of queries regardless of the number of rows.
+    The template can be the template of the whole queryset (e.g: `[{...}]`), compiled or not, or a compiled match node.
+    `values()` / `values_list()` and combined querysets, or querysets that don't support the lookups, are returned unchanged.
+    '''
+    from django.db import NotSupportedError
+
+    if not _plannable(queryset):
+        return queryset
+    select_related, prefetch_related = prefetch_paths(_match_node(template), queryset.model)
+    planned = queryset
+    try:
+        if select_related:
+            planned = planned.select_related(*select_related)
+        if prefetch_related:
+            planned = planned.prefetch_related(*prefetch_related)
+    except NotSupportedError:
+        return queryset
+    return planned
+
+
+def _project(plan, queryset, values):
+    from django.db.models import Prefetch
+
+    # Lookups the queryset already prefetches are kept, with their queryset
+    prefetched = {getattr(lookup, 'prefetch_to', lookup) for lookup in queryset._prefetch_related_lookups}
+
+    if values and plan.flat and plan.fields and not prefetched:
+        return queryset.values(*plan.fields)
+
+    if plan.select_related:
+        queryset = queryset.select_related(*plan.select_related)
+
+    prefetches = []
+    for lookup, sub_plan, field in plan.prefetch_related:
+        if lookup in prefetched:
+            # Relations under it are prefetched through the queryset given for it
+            prefetches += [f"{lookup}__{sub_lookup}" for sub_lookup in sub_plan.select_related + sub_plan.lookups()]
+            continue
+        sub_queryset = sub_plan.model._default_manager.all()
+        if sub_plan.fields is not None and field.one_to_many:
+            # The foreign key is needed to link the prefetched rows to their instance
+            sub_plan.fields.append(field.field.name)
+        prefetches.append(Prefetch(lookup, queryset=_project(sub_plan, sub_queryset, False)))
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches)
+
+    if plan.fields is not None:
+        queryset = queryset.only(*plan.fields or ['pk'])
+    return queryset
+
+
+def project_queryset(template, queryset, values=True):
+    '''
+    Restrict the columns fetched by the queryset to the fields read by the match template (signals and static values),
+    on the queryset and on the related querysets it selects or prefetches.
+    - `values(...)` is used when the template only reads fields of the model and `values` is set,
+      rows are then dictionaries read directly by the matching
+    - `only(...)` is used otherwise
+    Nothing is restricted when the template reads attributes that aren't fields, as the fields they need are unknown,
+    nor on `values()` / `values_list()` and combined querysets, or querysets that don't support the lookups.
+    '''
+    from django.db import NotSupportedError
+
+    if not _plannable(queryset):
+        return queryset
+    try:
+        return _project(query_plan(_match_node(template), queryset.model), queryset, values)
+    except NotSupportedError:
+        return queryset
@@ -0,0 +1,157 @@
+import collections
+import concurrent.futures
+import importlib
+import itertools
+import multiprocessing
+import os
+import pickle
+
+from . import InNOut, CompiledTemplate
+from .interface import transform
+
+# Templates & options of the current worker process, set once by `_init_worker`
+_worker_state = None
+
+# name -> function, see `register_function`
+_registry = {}
+
+
+class RegisteredFunction():
+    '''
+    Picklable reference to a function registered with `register_function`.
+    Only the name and the module registering the function are pickled. The module is imported again
+    in the worker process, which registers the function there as well.
+    '''
+
+    def __init__(self, name, module):
+        self.name = name
+        self.module = module
+
+    def __call__(self, *args, **kwargs):
+        if self.name not in _registry and self.module:
+            importlib.import_module(self.module)
+        return _registry[self.name](*args, **kwargs)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name})"
+
+
+def register_function(name, func=None):
+    '''
+    Register a transform function under `name` to use lambdas or closures in templates sent to worker processes.
+    Registration must happen when the module is imported.
+
+    >>> lower = register_function('lower', lambda x: x.lower())
+    >>> template = {'name': MatchTrans(S('name'), lower)}
+
+    Can also be used as a decorator: `@register_function('lower')`
+    '''
+    def register(func):
+        _registry[name] = func
+        return RegisteredFunction(name, getattr(func, '__module__', None))
+
+    if func is None:
+        return register
+    return register(func)
+
+
+def _init_worker(match_template, format_template, debug, deepclean, compact):
+    global _worker_state
+    if not isinstance(match_template, CompiledTemplate):
+        match_template = InNOut.compile(match_template)
+    if not isinstance(format_template, CompiledTemplate):
+        format_template = InNOut.compile(format_template)
+    _worker_state = (match_template, format_template, debug, deepclean, compact)
+
+
+def _transform_chunk(chunk):
+    match_template, format_template, debug, deepclean, compact = _worker_state
+    return [transform(data, match_template, format_template, debug, deepclean, compact) for data in chunk]
+
+
+def _chunks(datas, chunk_size):
+    datas = iter(datas)
+    while True:
+        chunk = list(itertools.islice(datas, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _mp_context(templates, mp_context):
+    '''
+    Templates are sent once to each worker through the pool initializer.
+    When they can't be pickled (e.g: lambdas in Trans/MatchTrans/FormatTrans) and no context is given,
+    use fork so workers inherit them without pickling. A context given by the caller is never replaced.
+    '''
+    try:
+        pickle.dumps(templates)
+        return mp_context
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        if mp_context is not None:
+            reason = f"with the given mp_context ({mp_context.get_start_method()})"
+        elif 'fork' not in multiprocessing.get_all_start_methods():
+            reason = "and fork is not available"
+        else:
+            return multiprocessing.get_context('fork')
+        raise ValueError(
+            f"Templates can't be sent to worker processes {reason}: {e}. "
+            "Use module level functions or `register_function` for transform functions."
+        ) from e
+
+
+def transform_parallel(datas, match_template, format_template, debug=None, deepclean=False, compact=False,
+                       max_workers=None, chunk_size=100, ordered=True, mp_context=None):
+    '''
+    Transform every data of `datas` in a process pool, yielding the results one by one.
+    Results are the same as calling `transform` for each data.
+    Templates are checked when called, the pool is started once the results are iterated.
+
+    datas: iterable of data, consumed lazily by chunks of `chunk_size`
+    max_workers: number of worker processes, default to the number of CPUs
+    ordered: yield results in the order of `datas`. Otherwise yield them as soon as their chunk is done
+    mp_context: multiprocessing context of the pool
+    '''
+    max_workers = max_workers or os.cpu_count() or 1
+    # Compiled templates are checked once for the batch, before being sent to the workers
+    for template in (match_template, format_template):
+        if isinstance(template, CompiledTemplate):
+            template.check()
+    initargs = (match_template, format_template, debug, deepclean, compact)
+    mp_context = _mp_context(initargs, mp_context)
+    return _transform_parallel(datas, initargs, max_workers, chunk_size, ordered, mp_context)
+
+
+def _transform_parallel(datas, initargs, max_workers, chunk_size, ordered, mp_context):
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=mp_context,
+        initializer=_init_worker,
+        initargs=initargs,
+    )
+
+    with executor:
+        # Bound the number of chunks in flight so memory doesn't grow with the number of data
+        max_pending = 2 * max_workers
+        chunks = _chunks(datas, chunk_size)
+        pending = collections.deque()
+
+        for chunk in chunks:
+            pending.append(executor.submit(_transform_chunk, chunk))
+            if len(pending) < max_pending:
+                continue
+
+            if ordered:
+                yield from pending.popleft().result()
+            else:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    yield from future.result()
+
+        if ordered:
+            while pending:
+                yield from pending.popleft().result()
+        else:
+            for future in concurrent.futures.as_completed(pending):
+                yield from future.result()
@@ -1,16 +1,33 @@
 import logging
-from pydash import _
+from collections.abc import Iterable, Mapping
 
 from . import S
 
 logger = logging.getLogger('in_n_out')
 
-class Store():
+
+def flatten(values):
+    '''
+    Flatten a list a single level deep. Strings, bytes and mappings are not flattened.
+    '''
+    result = []
+    for value in values:
+        if isinstance(value, Iterable) and not isinstance(value, (str, bytes, bytearray, Mapping)):
+            result.extend(value)
+        else:
+            result.append(value)
+    return result
+
+class BaseStore():
     '''
     Store are created everytime there is a list_like element in the data.
     Each element of that list is its own store.
     Check test `test_storage` for explaination
+
+    BaseStore holds the logic shared by `Store` and `CompactStore`, and declares no attribute storage itself.
     '''
+    __slots__ = ()
+    empty_children = list
 
     def __init__(self, previous_store):
         '''
@@ -19,59 +36,159 @@ class Store():
         depth: int
         '''
         self.values = {}
-        self.children = []
+        self.children = self.empty_children()
         self.parent = None
         self.depth = previous_store.depth + 1 if previous_store else 0
+        self._index = None
+        self._scope = None
 
         if previous_store:
-            previous_store.children.append(self)
+            previous_store.add_child(self)
             self.parent = previous_store
 
+    def add_child(self, store):
+        self.children.append(store)
+        self.__invalidate()
+
     def add(self, key, value):
         self.values[key] = value
+        self.__invalidate()
+        if self._scope is not None:
+            self.__invalidate_scopes()
+
+    def remove_empty_children(self):
+        '''
+        Remove the children stores without any values.
+        '''
+        self.children = [child for child in self.children if child.values]
+        self.__invalidate()
+
+    def __invalidate(self):
+        # A store with an index implies all its children have one, so stop at the first store without index
+        store = self
+        while store is not None and store._index is not None:
+            store._index = None
+            store = store.parent
+
+    def __invalidate_scopes(self):
+        # A store with a scope implies its parent has one, so stop at the stores without scope
+        stack = [self]
+        while stack:
+            store = stack.pop()
+            if store._scope is not None:
+                store._scope = None
+                stack.extend(store.children)
+
+    @property
+    def scope(self):
+        '''
+        signal.key -> value of the signal in this store, or in the closest parent having it.
+        Built when first needed from the scope of the parent, and shared with it when the store has no values of its own,
+        so inherited signals are found with a single lookup whatever the depth.
+        '''
+        if self._scope is None:
+            chain = []
+            store = self
+            while store is not None and store._scope is None:
+                chain.append(store)
+                store = store.parent
+
+            scope = store._scope if store is not None else {}
+            for store in reversed(chain):
+                values = {key: value for key, value in store.values.items() if value is not None}
+                if values:
+                    scope = {**scope, **values}
+                store._scope = scope
+        return self._scope
+
+    @property
+    def signal_index(self):
+        '''
+        Frozen set of the signal keys having a value in this store or any of its children.
+        Built when first needed once the matching is done, and rebuilt if the store tree changes.
+        Stores are indexed children first from an explicit stack, so store trees of any depth can be indexed.
+        A store reuses the set of its largest child when it holds all the other keys, so chains of stores share one set,
+        and stores with the same keys share one set as well.
+        The root always builds its own, so a rebuilt root index is a new set (check `SignalMemo`).
+        '''
+        if self._index is None:
+            # Stores with an index have one for all their children as well, only visit the stores without
+            stores = []
+            stack = [self]
+            while stack:
+                store = stack.pop()
+                stores.append(store)
+                stack.extend(child for child in store.children if child._index is None)
+
+            shared = {}
+            for store in reversed(stores):
+                indexes = [child._index for child in store.children]
+                index = max(indexes, key=len, default=None)
+                if (
+                    index is None
+                    or store.parent is None
+                    or not store.values.keys() <= index
+                    or not all(child_index <= index for child_index in indexes)
+                ):
+                    index = frozenset(store.values).union(*indexes)
+                    if store.parent is not None:
+                        index = shared.setdefault(index, index)
+                store._index = index
+        return self._index
 
     def as_dict(self):
-        return {
-            'values': self.values,
-            'depth': self.depth,
-            'children': [s.as_dict() for s in self.children]
-        }
+        result = {'values': self.values, 'depth': self.depth, 'children': []}
+        stack = [(self, result)]
+        while stack:
+            store, store_dict = stack.pop()
+            for child in store.children:
+                child_dict = {'values': child.values, 'depth': child.depth, 'children': []}
+                store_dict['children'].append(child_dict)
+                stack.append((child, child_dict))
+        return result
 
     def __search_current(self, signal):
-        for key, value in self.values.items():
-            if key == signal.key:
-                return value
+        return self.values.get(signal.key)
 
     def __search_deep(self, signal: S):
         value = self.__search_current(signal)
         if value is not None:
             return value
 
-        # gather all value from children if it cannot be found in current store
-        values = _.filter(_.map(self.children, lambda store: store.__search_deep(signal)), lambda x: x != None)
+        # gather all value from children if it cannot be found in current store,
+        # skipping the children without the signal.
+        # The closest values of each branch are gathered depth first, in the order of the children.
+        key = signal.key
+        values = []
+        stack = [store for store in reversed(self.children) if key in store.signal_index]
+        while stack:
+            store = stack.pop()
+            value = store.values.get(key)
+            if value is not None:
+                values.append(value)
+            else:
+                stack.extend(child for child in reversed(store.children) if key in child.signal_index)
         if values:
-            return _.flatten(values)
+            return flatten(values)
 
-    def __search_parents(self, signal: S):
-        value = self.__search_current(signal)
-        if value is not None:
-            return value
-
-        if self.parent:
-            return self.parent.__search_parents(signal)
-
-    def get_signal_value(self, signal: S, search_deep=True):
+    def get_own_signal_value(self, signal: S, search_deep=True):
+        '''
+        Value of the signal in this store, or in its children when search_deep. Parents are not searched.
+        '''
         if search_deep:
-            value = self.__search_deep(signal)
-            if value is not None:
-                return value
+            # No need to look into the children if none of them has the signal
+            if signal.key in self.signal_index:
+                return self.__search_deep(signal)
         else:
-            value = self.__search_current(signal)
-            if value is not None:
-                return value
+            return self.__search_current(signal)
+
+    def get_signal_value(self, signal: S, search_deep=True):
+        value = self.get_own_signal_value(signal, search_deep)
+        if value is not None:
+            return value
 
         if self.parent:
-            return self.parent.__search_parents(signal)
+            return self.parent.scope.get(signal.key)
 
 
     def get_deepest_stores_for_signals(self, signals):
@@ -79,28 +196,41 @@ class Store():
         Give a list of signals and find the deepest stores where one of the signal is present.
         Only consider the deepest stores for a given branch
         Stop once all signals' stores are found
+        Children are searched from an explicit stack, so store trees of any depth can be searched.
         '''
-        signals_left = []
-        for signal in signals:
-            if self.__search_current(signal) is None:
-                signals_left.append(signal)
-
+        signals_left = [signal for signal in signals if self.__search_current(signal) is None]
         # if we're found the last signals missing return the store as it is the deepest one for our search
-        if len(signals_left) == 0:
+        if not signals_left:
             return [self]
 
-        # if not keep looking deeper
-        children_stores = []
-        for child in self.children:
-            stores = child.get_deepest_stores_for_signals(signals_left)
-            children_stores += stores
-
-        # If looking deeper does not yield any result, and the current store has the value of a signal,
-        # return that store, as it is the deepest one with a value
-        if len(children_stores) == 0 and len(signals_left) < len(signals):
-            return [self]
-        else:
-            return children_stores
+        # [store, signals, signals left, iterator of the children left to search, deepest stores found in the children]
+        stack = [[self, signals, signals_left, iter(self.children), []]]
+        while True:
+            store, signals, signals_left, children, stores = stack[-1]
+            # if not keep looking deeper, only in the children having at least one of the signals left
+            for child in children:
+                index = child.signal_index
+                for signal in signals_left:
+                    if signal.key in index:
+                        break
+                else:
+                    continue
+                values = child.values
+                child_signals_left = [signal for signal in signals_left if values.get(signal.key) is None]
+                if not child_signals_left:
+                    stores.append(child)
+                else:
+                    stack.append([child, signals_left, child_signals_left, iter(child.children), []])
+                    break
+            else:
+                stack.pop()
+                # If looking deeper does not yield any result, and the current store has the value of a signal,
+                # return that store, as it is the deepest one with a value
+                if not stores and len(signals_left) < len(signals):
+                    stores = [store]
+                if not stack:
+                    return stores
+                stack[-1][4] += stores
 
 
     def __str__(self):
@@ -108,3 +238,80 @@ class Store():
 
     def __repr__(self):
         return f"{self.__class__.__name__}({self.values}, {self.children}, {self.depth})"
+
+
+class Store(BaseStore):
+    '''
+    Default store, with its attributes in a regular instance dictionary.
+    '''
+
+
+class CompactStore(BaseStore):
+    '''
+    Store using less memory, for matches creating a large number of stores.
+    Attributes are stored in slots, and stores without children share an empty tuple instead of each owning a list.
+    Same behaviour as `Store` otherwise. Check `InNOut(..., compact=True)`
+    '''
+    __slots__ = ('values', 'children', 'parent', 'depth', '_index', '_scope')
+    empty_children = tuple
+
+    def add_child(self, store):
+        if not self.children:
+            self.children = []
+        super().add_child(store)
+
+
+class SignalMemo():
+    '''
+    Values of the signals gathered from the children of the stores of a tree, by (store, signal.key).
+    Used for one format pass, where the same signals are fetched repeatedly from the same stores,
+    to avoid collecting & flattening the values of the children each time.
+    Values found in the store itself or its parents are cheap to get, and not memoized.
+    Values are forgotten when the store tree changes, which resets the signal index of its root.
+
+    hits & misses count the lookups of children values found or not in the memo.
+    The memo is local to the pass, only its counters are kept once done, check `stats`.
+    '''
+
+    def __init__(self, root):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        self.__values = {}
+        self.__index = None
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def get_signal_value(self, store, signal: S, search_deep=True):
+        '''
+        Same as `store.get_signal_value`.
+        '''
+        key = signal.key
+        value = store.values.get(key)
+        if value is not None:
+            return value
+
+        if search_deep and key in store.signal_index:
+            # The index of the root is reset when any store of the tree changes
+            index = self.root._index
+            if index is None or index is not self.__index:
+                self.__values = {}
+                self.__index = self.root.signal_index
+
+            memo_key = (store, key)
+            value = self.__values.get(memo_key)
+            if memo_key in self.__values:
+                self.hits += 1
+            else:
+                self.misses += 1
+                value = self.__values[memo_key] = store.get_own_signal_value(signal, True)
+            if value is not None:
+                # Lists are copied, so the memoized value can't be changed by the caller
+                return list(value) if isinstance(value, list) else value
+
+        if store.parent:
+            return store.parent.scope.get(key)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(hits={self.hits}, misses={self.misses})"
@@ -0,0 +1,323 @@
+import xml.etree.ElementTree as ElementTree
+
+try:
+    import ijson
+except ModuleNotFoundError:
+    ijson = None
+
+from . import InNOut
+from .log import logger, debug
+from .compiled_template import SIGNAL, TRANS, DICT, LIST
+
+START = ('start_map', 'start_array')
+END = ('end_map', 'end_array')
+
+
+###########
+# EVENTS
+###########
+
+def object_events(data):
+    '''
+    Events of an in memory object, the same as the ones of `ijson.basic_parse` for the equivalent JSON document:
+    (event, value) with event one of start_map, map_key, end_map, start_array, end_array, null, boolean, number, string
+    '''
+    if isinstance(data, dict):
+        yield ('start_map', None)
+        for key, value in data.items():
+            yield ('map_key', key)
+            yield from object_events(value)
+        yield ('end_map', None)
+    elif isinstance(data, (list, tuple)):
+        yield ('start_array', None)
+        for value in data:
+            yield from object_events(value)
+        yield ('end_array', None)
+    elif data is None:
+        yield ('null', None)
+    elif isinstance(data, bool):
+        yield ('boolean', data)
+    elif isinstance(data, (int, float)):
+        yield ('number', data)
+    else:
+        yield ('string', data)
+
+
+def json_events(file):
+    '''
+    Events of a JSON document, parsed incrementally from a file like object. Requires `ijson`.
+    '''
+    if ijson is None:
+        raise ModuleNotFoundError("ijson is required to stream JSON documents. Install it with `pip install ijson`")
+    return ijson.basic_parse(file, use_float=True)
+
+
+def xml_events(file):
+    '''
+    Events of a XML document, parsed incrementally from a file like object or a path.
+    The events follow xmltodict conventions:
+    - the document is a dictionary with the root tag as only key
+    - attributes are `@name` keys, and text is under `#text` when the element has attributes or children
+    - elements without attributes or children are strings, None when empty
+    - repeated children are repeated keys, that are matched as xmltodict lists
+    Elements are dropped once their events are emitted, so the document is never held in memory.
+    '''
+    def start_map(element):
+        yield ('start_map', None)
+        for key, value in element.attrib.items():
+            yield ('map_key', f"@{key}")
+            yield ('string', value)
+
+    yield ('start_map', None)
+    # [element, whether its map is started]
+    stack = []
+    for event, element in ElementTree.iterparse(file, events=('start', 'end')):
+        if event == 'start':
+            # The parent is a dictionary, as it has at least one child
+            if stack and not stack[-1][1]:
+                yield from start_map(stack[-1][0])
+                stack[-1][1] = True
+
+            yield ('map_key', element.tag)
+            stack.append([element, bool(element.attrib)])
+            if element.attrib:
+                yield from start_map(element)
+        else:
+            _, map_started = stack.pop()
+            text = element.text.strip() if element.text else None
+            if map_started:
+                if text:
+                    yield ('map_key', '#text')
+                    yield ('string', text)
+                yield ('end_map', None)
+            elif text:
+                yield ('string', text)
+            else:
+                yield ('null', None)
+
+            element.clear()
+            if stack:
+                stack[-1][0].remove(element)
+    yield ('end_map', None)
+
+
+###########
+# MATCHING
+###########
+
+class StreamingInNOut(InNOut):
+    '''
+    InNOut matching a stream of events (check `object_events` for the events format) instead of an in memory object.
+    Lists are matched one element at a time, and data not addressed by the template is skipped without being built.
+    Only values that need to be seen as a whole are built in memory, pruned to the keys used by the template:
+    values of signals and MatchTrans, dictionaries with static values to check, and list elements matched by several templates.
+
+    The resulting stores are the same as matching the whole document with `InNOut`.
+    '''
+
+    def match_root(self, events):
+        self.data = None
+        self.__orders = {}
+        events = iter(events)
+        for event, value in events:
+            self.__stream(self.compiled.match_plan, event, value, events, self.root_store)
+            return
+
+    def __debug(self, s, *args):
+        debug(self.__class__.__name__, self.debug_log, s, *args)
+
+    def __skip(self, event, events):
+        if event not in START:
+            return
+        depth = 1
+        for event, _ in events:
+            if event in START:
+                depth += 1
+            elif event in END:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def __element_node(self, node):
+        # Elements of a list matched by several templates are built entirely
+        return node.elements[0] if len(node.elements) == 1 else None
+
+    def __project(self, node, event, value, events):
+        '''
+        Build the value starting with `event`, keeping only the keys used by the node. Keep everything if node is None.
+        '''
+        if node is not None and node.kind == LIST:
+            if event != 'start_array':
+                return self.__project(self.__element_node(node), event, value, events)
+            element_node = self.__element_node(node)
+        else:
+            element_node = node
+
+        if event == 'start_map':
+            keys = node.keys if node is not None and node.kind == DICT else None
+            result = {}
+            repeated = set()
+            for event, key in events:
+                if event == 'end_map':
+                    return result
+                event, value = next(events)
+                if keys is not None and key not in keys:
+                    self.__skip(event, events)
+                    continue
+
+                item = self.__project(keys[key] if keys is not None else None, event, value, events)
+                # Repeated keys are lists, as done by xmltodict
+                if key not in result:
+                    result[key] = item
+                elif key in repeated:
+                    result[key].append(item)
+                else:
+                    result[key] = [result[key], item]
+                    repeated.add(key)
+
+        elif event == 'start_array':
+            result = []
+            for event, value in events:
+                if event == 'end_array':
+                    return result
+                result.append(self.__project(element_node, event, value, events))
+        else:
+            return value
+
+    def __stream(self, node, event, value, events, store):
+        '''
+        Match the value starting with `event` against the node, consuming all its events.
+        '''
+        kind = node.kind
+        if event == 'null' and kind != TRANS:
+            self.__debug("No data available for matching, path=%s", node.path)
+        elif kind == DICT and event == 'start_map' and not node.guards:
+            self.__debug("Streaming dict path=%s", node.path)
+            self.__stream_dict(node, events, store)
+        elif kind == DICT and event == 'start_array':
+            self.__stream_first(node, events, store)
+        elif kind == LIST:
+            self.__debug("Streaming list path=%s", node.path)
+            self.__stream_list(node, event, value, events, store)
+        elif kind in (SIGNAL, TRANS, DICT):
+            self.match(node, self.__project(node, event, value, events), node.path, store)
+        else:
+            self.__skip(event, events)
+
+    def __order(self, node):
+        order = self.__orders.get(node)
+        if order is None:
+            order = self.__orders[node] = {key: idx for idx, key in enumerate(node.keys)}
+        return order
+
+    def __stream_dict(self, node, events, store):
+        # Stores created by list children are reordered following the template, as done by `InNOut`
+        segments = []
+        start = len(store.children)
+        # Values are written to the store once the dictionary is read, key by key in the template order as done by `InNOut`,
+        # so the last write of a signal doesn't depend on the data order.
+        # Signals & MatchTrans are matched then, as repeated keys are lists. Values written by the other keys are kept aside.
+        pending = {}
+        written = {}
+        seen = set()
+
+        for event, key in events:
+            if event == 'end_map':
+                break
+            event, value = next(events)
+            child = node.keys.get(key)
+            if child is None:
+                self.__skip(event, events)
+            elif child.kind in (SIGNAL, TRANS):
+                pending.setdefault(key, []).append(self.__project(child, event, value, events))
+            elif child.kind == DICT and key in seen:
+                logger.warning("Matching template is a dictionary but data is a list. Taking first element of the list. It is advised to fix these. path=%s key=%s", node.path, key)
+                self.__skip(event, events)
+            else:
+                before = len(store.children)
+                values, store.values = store.values, {}
+                try:
+                    self.__stream(child, event, value, events, store)
+                finally:
+                    written.setdefault(key, {}).update(store.values)
+                    store.values = values
+                segments.append((self.__order(node)[key], store.children[before:]))
+            seen.add(key)
+
+        for key, child in node.children:
+            if key in pending:
+                values = pending[key]
+                self.match(child, values[0] if len(values) == 1 else values, child.path, store)
+            elif key in written:
+                for signal, value in written[key].items():
+                    store.add(signal, value)
+            elif child.kind == TRANS:
+                self.match(child, None, child.path, store)
+
+        orders = [order for order, _ in segments]
+        if orders != sorted(orders):
+            store.children[start:] = [s for _, stores in sorted(segments, key=lambda x: x[0]) for s in stores]
+
+    def __stream_first(self, node, events, store):
+        logger.warning("Matching template is a dictionary but data is a list. Taking first element of the list. It is advised to fix these. path=%s", node.path)
+        event, value = next(events)
+        if event == 'end_array':
+            self.match(node, [], node.path, store)
+            return
+
+        if event == 'null':
+            # The keys of a missing first element are None, MatchTrans still run as done by `InNOut`
+            self.match(node, [None], node.path, store)
+        else:
+            self.__stream(node, event, value, events, store)
+        for event, value in events:
+            if event == 'end_array':
+                return
+            self.__skip(event, events)
+
+    def __stream_element(self, node, event, value, events, store, stores):
+        if len(node.elements) == 1:
+            child = self.store_class(store)
+            self.__stream(node.elements[0], event, value, events, child)
+            children = [(0, child)]
+        else:
+            data = self.__project(None, event, value, events)
+            children = []
+            for idx, element in enumerate(node.elements):
+                child = self.store_class(store)
+                self.match(element, data, element.path, child)
+                children.append((idx, child))
+
+        # Drop empty stores right away, the element is not needed anymore.
+        # The stores of this element are the last children of the store.
+        kept = [(idx, child) for idx, child in children if child.values]
+        if len(kept) != len(children):
+            del store.children[len(store.children) - len(children):]
+            store.children.extend(child for _, child in kept)
+        stores.extend(kept)
+
+    def __stream_list(self, node, event, value, events, store):
+        start = len(store.children)
+        stores = []
+
+        # To handle xmltodict, if the template request a list, but the data isn't one,
+        # make the data the only element in the list
+        if event != 'start_array':
+            self.__stream_element(node, event, value, events, store, stores)
+        else:
+            for event, value in events:
+                if event == 'end_array':
+                    break
+                self.__stream_element(node, event, value, events, store, stores)
+
+        # Stores are created element by element, order them template element first as done by `InNOut`
+        if len(node.elements) > 1 and stores:
+            store.children[start:] = [child for _, child in sorted(stores, key=lambda x: x[0])]
+        store.remove_empty_children()
+
+
+def match_stream(template, events, debug=None, compact=False):
+    '''
+    Match a stream of events (from `json_events`, `xml_events`, `object_events` or `ijson.basic_parse`) against the template.
+    '''
+    return StreamingInNOut(template, events, debug, compact=compact)
@@ -1,5 +1,19 @@
+import contextlib
+import csv
+import gzip
+import json
+import io
+import logging
+import multiprocessing
+import os
+import pickle
 import random
+import subprocess
+import sys
+import tempfile
+import types
 import unittest
+import unittest.mock
 from django.db.models.query import QuerySet
 
 from pydash import _
@@ -9,11 +23,17 @@ from django.test import TestCase, testcases
 # from apps.common.models import Application
 # from apps.common.models.tests.utils import create_entire_mock_application
 
-from . import match, format, transform, S, FormatTrans, MatchTrans, Trans, utils as RegUtils
+from . import match, format, iter_format, write_ndjson, write_csv, transform, match_many, transform_many, transform_parallel, register_function, match_stream, S, FormatTrans, MatchTrans, Trans, CompactStore, utils as RegUtils
 from .match_trans import MatchTransException, IncorrectMatchTypeException
-from .in_n_out import IncorrecTypeException
+from .in_n_out import IncorrecTypeException, InNOut
+from .compiled_template import CompiledTemplate, TemplateMutatedException
+from .store import SignalMemo
+from .streaming import ijson, object_events, json_events, xml_events
 
 
+# Registered at import, so worker processes register it as well when importing this module
+upper = register_function('test_upper', lambda x: x.upper())
+
 test_match_template = {
     'profile_list': [{
         'first_name': S('first_name'),
@@ -246,6 +266,91 @@ class TestStorage(unittest.TestCase):
             'street_address': 1,
         })
 
+    def test_signal_index(self):
+        index = self.matched.root_store.signal_index
+        self.assertEqual(index, {'first_name', 'last_name', 'street_address', 'postal_code', 'street_crossing_name'})
+        self.assertEqual(self.matched.root_store.children[1].children[0].signal_index, {
+            'street_address', 'postal_code', 'street_crossing_name',
+        })
+
+    def test_signal_index_invalidation(self):
+        m = match(self.match_template, self.data)
+        root = m.root_store
+        self.assertNotIn('nickname', root.signal_index)
+
+        root.children[1].add('nickname', 'bry')
+        self.assertIn('nickname', root.signal_index)
+        self.assertEqual(root.get_signal_value(S('nickname')), ['bry'])
+
+        crossing = root.children[1].children[0].children[0]
+        self.assertNotIn('postal_code', crossing.signal_index)
+        crossing.add('postal_code', '0')
+        self.assertIn('postal_code', crossing.signal_index)
+        self.assertIn('postal_code', root.children[1].signal_index)
+        self.assertEqual(crossing.get_own_signal_value(S('postal_code')), '0')
+
+    def test_scope(self):
+        m = match(self.match_template, self.data)
+        address = m.root_store.children[0].children[0]
+        crossing = address.children[0]
+        self.assertEqual(crossing.scope, {
+            'first_name': 'Marc',
+            'last_name': 'Simon',
+            'street_address': '123 main st',
+            'postal_code': '12345',
+            'street_crossing_name': 'main',
+        })
+        self.assertEqual(crossing.get_signal_value(S('first_name'), False), 'Marc')
+        # Stores without values of their own share the scope of their parent
+        empty = type(address)(address)
+        self.assertIs(empty.scope, address.scope)
+
+        # Scopes of the children are rebuilt when a parent value changes
+        m.root_store.children[0].add('first_name', 'Mario')
+        self.assertEqual(crossing.get_signal_value(S('first_name'), False), 'Mario')
+        self.assertEqual(empty.scope['first_name'], 'Mario')
+
+    def test_signal_memo(self):
+        m = match(self.match_template, self.data)
+        crossings = ['main', 'hide', 'mission', '16th', 'pasadena', 'mcallister']
+        res = m.format({'names': [S('first_name')], 'crossings': [S('street_crossing_name')], 'again': [S('street_crossing_name')]})
+        self.assertEqual(res, {'names': ['Marc', 'Bryan'], 'crossings': crossings, 'again': crossings})
+        # Only values gathered from the children are memoized, the memo isn't kept after the pass
+        self.assertEqual(m.format_stats, {'hits': 2, 'misses': 2})
+        self.assertFalse(hasattr(m, 'signal_memo'))
+        list(m.iter_format([S('street_crossing_name')]))
+        self.assertEqual(m.format_stats, {'hits': 0, 'misses': 2})
+
+        # Memoized lists are not shared with the results
+        root = m.root_store
+        memo = SignalMemo(root)
+        memo.get_signal_value(root, S('street_crossing_name')).append('castro')
+        self.assertEqual(memo.get_signal_value(root, S('street_crossing_name')), crossings)
+        self.assertEqual(memo.stats(), {'hits': 1, 'misses': 1})
+
+        # Changing the store tree empties the memo
+        root.children[1].add('nickname', 'bry')
+        root.children[1].children[0].add('street_crossing_name', 'castro')
+        self.assertEqual(memo.get_signal_value(root, S('street_crossing_name')), crossings[:4] + ['castro'])
+        self.assertEqual(memo.misses, 2)
+
+    def test_compact_storage(self):
+        m = match(self.match_template, self.data, compact=True)
+        self.assertIsInstance(m.root_store, CompactStore)
+        self.assertFalse(hasattr(m.root_store, '__dict__'))
+        self.assertEqual(m.storage, self.matched.storage)
+
+        template = [{
+            'first_names': S('first_name'),
+            'postal_code': S('postal_code'),
+            'street_crossing_name': S('street_crossing_name')
+        }]
+        self.assertEqual(m.format(template), self.matched.format(template))
+        self.assertEqual(
+            m.root_store.get_deepest_stores_for_signals([S('first_name'), S('street_address')])[0].values,
+            self.matched.root_store.get_deepest_stores_for_signals([S('first_name'), S('street_address')])[0].values,
+        )
+
 class TestError(unittest.TestCase):
     def setUp(self):
         self.match_template = test_match_template
@@ -268,6 +373,13 @@ class TestError(unittest.TestCase):
         with self.assertRaises(IncorrecTypeException):
             self.matched.format(template)
 
+    def test_record_value_is_list(self):
+        matched = match({'profiles': [{'name': S('name'), 'tags': S('tags')}]}, {'profiles': [{'name': 'Marc', 'tags': ['a', 'b']}]})
+        self.assertEqual(matched.format([{'name': S('name'), 'tags': [S('tags')]}]), [{'name': 'Marc', 'tags': ['a', 'b']}])
+
+        with self.assertRaises(IncorrecTypeException):
+            matched.format([{'name': S('name'), 'tags': S('tags')}])
+
 
 class TestTransposition(unittest.TestCase):
     '''
@@ -319,6 +431,26 @@ class TestTransposition(unittest.TestCase):
         self.assertEqual(res, expected)
 
 
+    def test_iter_format(self):
+        template = [{
+            'first_names': S('first_name'),
+            'postal_code': S('postal_code'),
+            'street_crossing_name': FormatTrans(S('street_crossing_name'), lambda x: formatted.append(x) or x),
+        }]
+        formatted = []
+        expected = self.matched.format(template)
+        formatted.clear()
+
+        rows = iter_format(template, self.matched)
+        self.assertEqual(next(rows), expected[0])
+        # Rows are built as they are consumed
+        self.assertEqual(formatted, ['main'])
+        self.assertEqual([expected[0]] + list(rows), expected)
+
+        self.assertEqual(list(self.matched.iter_format({'none': S('missing')}, deepclean=True)), [])
+        self.assertEqual(list(self.matched.iter_format({'none': S('missing')})), [{}])
+        self.assertEqual(list(self.matched.iter_format([S('missing')])), [])
+
     def test_transpose_street_name_acc_crossing(self):
         '''
         In this case, we want to get all the street_address & postal_code in a dict, with their profile
@@ -1510,3 +1642,559 @@ class TestXmlToDictSpecific(TestCase):
             'last_name': 'Simon'
         }]
         self.assertEqual(res, expected)
+
+
+class TestCompiledTemplate(unittest.TestCase):
+    def test_compiled_storage(self):
+        compiled = InNOut.compile(test_match_template)
+        self.assertEqual(match(compiled, test_data).storage, match(test_match_template, test_data).storage)
+
+    def test_compiled_reuse(self):
+        match_template = {
+            'profiles': [{
+                'username': S('username'),
+                'role': 'admin',
+            }],
+        }
+        format_template = [S('username')]
+        compiled = InNOut.compile(match_template)
+
+        for names in [['marc', 'bryan'], ['luigi'], []]:
+            data = {
+                'profiles': [{'username': name, 'role': 'admin'} for name in names] + [{'username': 'guest', 'role': 'user'}]
+            }
+            self.assertEqual(transform(data, compiled, format_template), names)
+            self.assertEqual(transform(data, compiled, format_template), transform(data, match_template, format_template))
+
+    def test_compiled_template_not_copied(self):
+        static = {'type': 'home'}
+        match_template = {'name': S('name'), 'address': static, 'list': [S('x')]}
+        compiled = InNOut.compile(match_template)
+        self.assertIs(compiled.template['address'], static)
+
+        # Unpickled templates are checked against their own copy
+        compiled = pickle.loads(pickle.dumps(compiled))
+        self.assertEqual(match(compiled, {'name': 'john'}).root_store.values, {'name': 'john'})
+
+    def test_compiled_template_mutated(self):
+        mutations = [
+            lambda t: t.update({'name': S('other')}),
+            lambda t: t.update({'new': S('new')}),
+            lambda t: t['list'].append(S('y')),
+            lambda t: setattr(t['name'], 'key', 'other'),
+            lambda t: setattr(t['trans'], 'func', str.upper),
+        ]
+        for mutate in mutations:
+            match_template = {'name': S('name'), 'list': [S('x')], 'trans': MatchTrans(S('t'), str.lower)}
+            compiled = InNOut.compile(match_template)
+            matched = match(compiled, {'name': 'john'})
+            mutate(match_template)
+
+            self.assertRaises(TemplateMutatedException, InNOut, compiled, {'name': 'john'}, check=True)
+            self.assertRaises(TemplateMutatedException, matched.format, compiled, check=True)
+            # Batches check the template once
+            self.assertRaises(TemplateMutatedException, list, match_many(compiled, [{'name': 'john'}]))
+            self.assertRaises(TemplateMutatedException, list, transform_many([{'name': 'john'}], compiled, [S('name')]))
+
+    def test_compiled_template_fingerprint(self):
+        # Only templates compiled beforehand are fingerprinted, and only checked on demand
+        match_template = {'name': S('name')}
+        compiled = CompiledTemplate(match_template)
+        match_template['other'] = S('other')
+        compiled.check()
+
+        compiled = InNOut.compile({'name': S('name')})
+        self.assertEqual(match(compiled, {'name': 'john'}).root_store.values, {'name': 'john'})
+        compiled.template['name'] = S('other')
+        self.assertEqual(match(compiled, {'name': 'john'}).root_store.values, {'name': 'john'})
+        self.assertRaises(TemplateMutatedException, compiled.check)
+
+    def test_compiled_trans(self):
+        template = {
+            'profiles': [{
+                'first_name': Trans(S('first_name'), format=lambda x: "First name is " + x, match=lambda x: x.lower()),
+                'last_name': FormatTrans(S('last_name'), lambda x: x.upper()),
+            }]
+        }
+        data = {
+            'profiles': [{
+                'first_name': 'Marc',
+                'last_name': 'Simon',
+            }]
+        }
+        compiled = InNOut.compile(template)
+
+        self.assertEqual(transform(data, compiled, template), {
+            'profiles': [{
+                'first_name': 'First name is marc',
+                'last_name': 'SIMON'
+            }]
+        })
+
+    def test_compiled_pruning(self):
+        accessed = []
+
+        class Profile():
+            def __init__(self, name):
+                self.name = name
+
+            def address(self):
+                accessed.append(self.name)
+                return {'street': 'main'}
+
+        match_template = {
+            'static': {'version': 2},
+            'profiles': [{
+                'name': S('name'),
+                'address': {'street': 'main'},  # static only, never extracted
+            }, {
+                'nested': [{'street': S('street')}],  # no signal at this depth, stores always dropped
+            }],
+        }
+        compiled = InNOut.compile(match_template)
+        plan = compiled.match_plan
+        self.assertEqual([key for key, _ in plan.children], ['profiles'])
+        profiles = plan.children[0][1]
+        self.assertEqual(len(profiles.elements), 1)
+        self.assertEqual([key for key, _ in profiles.elements[0].children], ['name'])
+
+        m = match(compiled, {'static': {'version': 1}, 'profiles': [Profile('marc'), Profile('bryan')]})
+        self.assertEqual(accessed, [])
+        self.assertEqual(m.storage, match(match_template, {'profiles': [{'name': 'marc'}, {'name': 'bryan'}]}).storage)
+
+    def test_data_accessed_once(self):
+        calls = []
+
+        class User():
+            def __init__(self, username, role):
+                self.username = username
+                self._role = role
+
+            def role(self):
+                calls.append(('role', self.username))
+                return self._role
+
+            def email(self):
+                calls.append(('email', self.username))
+                return f"{self.username}@mail.com"
+
+        match_template = {
+            'users': [{
+                'username': S('username'),
+                'email': S('email'),
+                'role': 'admin',
+            }, {
+                'username': S('username'),
+                'role': 'user',
+            }, {
+                'username': 'nobody',  # checked before calling role
+                'role': 'user',
+                'email': S('email'),
+            }]
+        }
+        users = [User('marc', 'admin'), User('bryan', 'user')]
+
+        res = transform({'users': users}, match_template, [{'username': S('username'), 'email': S('email')}])
+        self.assertEqual(res, [{'username': 'marc', 'email': 'marc@mail.com'}, {'username': 'bryan'}])
+        self.assertEqual(sorted(calls), [('email', 'marc'), ('role', 'bryan'), ('role', 'marc')])
+
+    def test_compiled_format(self):
+        format_template = {
+            'profiles': [{
+                'name': S('first_name'),
+                'address': {
+                    'postal_code': [S('postal_code')],
+                },
+            }],
+            'crossing': FormatTrans([S('street_crossing_name')], lambda x: len(x)),
+        }
+        compiled = InNOut.compile(format_template)
+        expected = match(test_match_template, test_data).format(format_template)
+
+        self.assertEqual(expected['crossing'], 6)
+        for i in range(2):
+            self.assertEqual(match(test_match_template, test_data).format(compiled), expected)
+
+
+class TestDepth(unittest.TestCase):
+    def nested(self, value, depth):
+        for i in range(depth):
+            value = {'child': value, 'name': f"level_{i}"}
+        return value
+
+    def test_deep_match(self):
+        depth = 5 * sys.getrecursionlimit()
+        match_template = self.nested({'value': S('value')}, depth)
+        data = self.nested({'value': 'deep'}, depth)
+        self.assertEqual(transform(data, match_template, {'value': S('value')}), {'value': 'deep'})
+
+    def test_deep_list_match(self):
+        # Each level is a list, so each level is a store.
+        # Stores of the chain share their signal index
+        depth = 5 * sys.getrecursionlimit()
+        match_template = {'value': S('value')}
+        data = {'value': 'deep'}
+        for i in range(depth):
+            match_template = {'name': S('name'), 'children': [match_template]}
+            data = {'name': f"level_{i}", 'children': [data]}
+
+        matched = match(match_template, data)
+        self.assertEqual(matched.root_store.signal_index, {'name', 'value'})
+        self.assertIs(matched.root_store.children[0].signal_index, matched.root_store.children[0].children[0].children[0].signal_index)
+        self.assertEqual(matched.format({'name': S('name'), 'values': [S('value')]}), {'name': f"level_{depth - 1}", 'values': ['deep']})
+        self.assertEqual(matched.format([{'value': S('value')}]), [{'value': 'deep'}])
+
+        store = matched.storage
+        for i in range(depth):
+            self.assertEqual(store['values'], {'name': f"level_{depth - i - 1}"})
+            store = store['children'][0]
+        self.assertEqual(store, {'values': {'value': 'deep'}, 'depth': depth, 'children': []})
+
+    def test_deep_clean(self):
+        depth = 5 * sys.getrecursionlimit()
+        res = transform({}, {}, FormatTrans(S('x'), lambda x: self.nested([None, 1, {}], depth)), deepclean=True)
+        for i in range(depth):
+            self.assertEqual(res['name'], f"level_{depth - i - 1}")
+            res = res['child']
+        self.assertEqual(res, [1])
+
+
+class TestUtils(unittest.TestCase):
+    def test_dict_join(self):
+        rows = [
+            {'ssn': 1, 'name': 'mario', 'color': None},
+            {'ssn': 2, 'name': 'luigi'},
+            {'ssn': 1, 'name': None, 'color': 'red'},
+            {'ssn': 1, 'color': 'blue'},
+        ]
+        self.assertEqual(RegUtils.dict_join(rows, 'ssn'), [
+            {'ssn': 1, 'name': 'mario', 'color': 'blue'},
+            {'ssn': 2, 'name': 'luigi'},
+        ])
+
+        rows = [{'a': 1, 'b': 1, 'x': 1}, {'a': 1, 'b': 2, 'y': 2}, {'a': 1, 'b': 1, 'y': 3}]
+        self.assertEqual(RegUtils.dict_join(rows, ['a', 'b']), [{'a': 1, 'b': 1, 'x': 1, 'y': 3}, {'a': 1, 'b': 2, 'y': 2}])
+
+    def test_join(self):
+        left = [{'ssn': 1, 'name': 'mario'}, {'ssn': 2, 'name': 'luigi'}, {'ssn': 1, 'name': 'wario'}]
+        right = [{'ssn': 1, 'color': 'red'}, {'ssn': 3, 'color': 'green'}, {'ssn': 1, 'hat': None}]
+        self.assertEqual(RegUtils.join(left, right, 'ssn'), [
+            {'ssn': 1, 'name': 'mario', 'color': 'red'},
+            {'ssn': 2, 'name': 'luigi'},
+            {'ssn': 1, 'name': 'wario', 'color': 'red'},
+        ])
+        self.assertEqual(RegUtils.join(left, right, ['ssn'], how=RegUtils.INNER), [
+            {'ssn': 1, 'name': 'mario', 'color': 'red'},
+            {'ssn': 1, 'name': 'wario', 'color': 'red'},
+        ])
+        self.assertEqual(left[0], {'ssn': 1, 'name': 'mario'})
+        self.assertRaises(ValueError, RegUtils.join, left, right, 'ssn', 'outer')
+
+    def test_stream_join(self):
+        def left():
+            for i in range(3):
+                yield {'id': i}
+                # Rows are joined before the next one is read
+                self.assertEqual(len(joined), i + 1)
+
+        joined = []
+        for row in RegUtils.stream_join(left(), [{'id': 1, 'value': 'one'}], 'id'):
+            joined.append(row)
+        self.assertEqual(joined, [{'id': 0}, {'id': 1, 'value': 'one'}, {'id': 2}])
+
+
+class TestImport(unittest.TestCase):
+    def test_django_not_imported(self):
+        # The package is imported from its parent directory
+        cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        code = f"import sys, {__package__} as p; print('django' in sys.modules, p.InNOut.list_like)"
+        out = subprocess.run([sys.executable, '-c', code], cwd=cwd, capture_output=True, text=True, check=True).stdout
+        self.assertEqual(out.strip(), "False (<class 'list'>, <class 'tuple'>)")
+
+    def test_lazy_modules(self):
+        cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        modules = ['multiprocessing', 'xml.etree.ElementTree', 'gzip', 'csv']
+        code = f"import sys, {__package__} as p; print([m in sys.modules for m in {modules}]); p.write_csv; print('csv' in sys.modules)"
+        out = subprocess.run([sys.executable, '-c', code], cwd=cwd, capture_output=True, text=True, check=True).stdout
+        self.assertEqual(out.split(), ['[False,', 'False,', 'False,', 'False]', 'True'])
+        self.assertRaises(AttributeError, getattr, sys.modules[__package__], 'missing')
+
+    def test_django_detected(self):
+        self.assertIn(QuerySet, InNOut.list_like)
+        self.assertIn(QuerySet, InNOut.non_static)
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.matched = match(test_match_template, test_data)
+        self.template = [{
+            'name': S('first_name'),
+            'address': {
+                'street': S('street_address'),
+                'postal_code': S('postal_code'),
+            },
+            'crossings': [S('street_crossing_name')],
+            'nickname': S('nickname'),
+        }]
+        self.expected = self.matched.format(self.template)
+
+    def test_write_ndjson(self):
+        out = io.StringIO()
+        self.assertEqual(write_ndjson(out, self.template, self.matched, buffer_size=2), 3)
+        self.assertEqual([json.loads(line) for line in out.getvalue().splitlines()], self.expected)
+
+        out = io.BytesIO()
+        write_ndjson(out, self.template, self.matched, compress=True)
+        self.assertFalse(out.closed)
+        lines = gzip.decompress(out.getvalue()).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.expected)
+
+        self.assertRaises(ValueError, write_ndjson, io.StringIO(), self.template, self.matched, compress=True)
+
+    def test_write_csv(self):
+        out = io.StringIO()
+        self.assertEqual(write_csv(out, self.template, self.matched), 3)
+        rows = list(csv.reader(io.StringIO(out.getvalue())))
+        self.assertEqual(rows[0], ['name', 'address.street', 'address.postal_code', 'crossings', 'nickname'])
+        self.assertEqual(rows[1], ['Marc', '123 main st', '12345', '["main", "hide"]', ''])
+        self.assertEqual(len(rows), 4)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.csv.gz')
+            write_csv(path, self.template, self.matched, header=False)
+            with gzip.open(path, 'rt', newline='') as f:
+                self.assertEqual(list(csv.reader(f)), rows[1:])
+
+        self.assertRaises(ValueError, write_csv, io.StringIO(), [S('first_name')], self.matched)
+
+
+class TestDebugLog(unittest.TestCase):
+    class Payload():
+        formatted = 0
+
+        def __str__(self):
+            TestDebugLog.Payload.formatted += 1
+            return 'payload'
+
+        __repr__ = __str__
+
+    def setUp(self):
+        TestDebugLog.Payload.formatted = 0
+
+    def test_no_formatting_when_debug_off(self):
+        payload = TestDebugLog.Payload()
+        template = {
+            'payload': S('payload'),
+            'other': MatchTrans(S('other'), lambda x: x),
+            'failing': MatchTrans(S('failing'), lambda x: x.missing),
+        }
+        logger = logging.getLogger('in_n_out')
+        level = logger.level
+        logger.setLevel(logging.ERROR)
+        try:
+            res = transform({'payload': payload, 'other': payload, 'failing': payload}, template, FormatTrans(S('payload'), lambda x: x))
+        finally:
+            logger.setLevel(level)
+
+        self.assertIs(res, payload)
+        self.assertEqual(TestDebugLog.Payload.formatted, 0)
+
+    def test_formatting_when_logger_enabled(self):
+        payload = TestDebugLog.Payload()
+        with self.assertLogs('in_n_out', level='DEBUG'):
+            match({'payload': S('payload')}, {'payload': payload})
+        self.assertGreater(TestDebugLog.Payload.formatted, 0)
+
+    def test_debug_does_not_stick_to_template(self):
+        compiled = InNOut.compile({'name': MatchTrans(S('name'), lambda x: x)})
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            match(compiled, {'name': 'john'}, debug=True)
+        self.assertIn('MatchTrans: ', out.getvalue())
+
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            match(compiled, {'name': 'john'})
+        self.assertEqual(out.getvalue(), '')
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.datas = [{
+            'profile_list': [{
+                'first_name': f"first_{i}_{j}",
+                'last_name': f"last_{i}_{j}",
+                'addresses': [],
+            } for j in range(i)]
+        } for i in range(5)]
+        self.format_template = [{
+            'first_name': S('first_name'),
+            'last_name': S('last_name'),
+        }]
+
+    def test_transform_many(self):
+        res = transform_many(iter(self.datas), test_match_template, self.format_template)
+        self.assertIsInstance(res, types.GeneratorType)
+        self.assertEqual(list(res), [transform(data, test_match_template, self.format_template) for data in self.datas])
+
+    def test_match_many(self):
+        res = list(match_many(test_match_template, self.datas))
+        self.assertEqual(len(res), len(self.datas))
+        for matched, data in zip(res, self.datas):
+            self.assertIs(matched.data, data)
+            self.assertIs(matched.compiled, res[0].compiled)
+            self.assertEqual(matched.storage, match(test_match_template, data).storage)
+
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        self.datas = [{'name': f"name_{i}", 'values': list(range(i % 7))} for i in range(50)]
+        self.match_template = {
+            'name': S('name'),
+            'values': [S('value')],
+        }
+        self.format_template = {
+            'name': S('name'),
+            'count': FormatTrans([S('value')], lambda x: len(x)),
+        }
+        self.expected = [transform(data, self.match_template, self.format_template) for data in self.datas]
+
+    def test_ordered(self):
+        res = transform_parallel(self.datas, self.match_template, self.format_template, max_workers=2, chunk_size=3)
+        self.assertEqual(list(res), self.expected)
+
+    def test_unordered(self):
+        res = transform_parallel(iter(self.datas), self.match_template, self.format_template, max_workers=2, chunk_size=4, ordered=False)
+        self.assertEqual(sorted(res, key=lambda x: x['name']), sorted(self.expected, key=lambda x: x['name']))
+
+    def test_registered_function(self):
+        match_template = {'name': MatchTrans(S('name'), upper)}
+        res = transform_parallel(
+            self.datas[:5],
+            match_template,
+            {'name': S('name')},
+            max_workers=1,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+        self.assertEqual(list(res), [{'name': data['name'].upper()} for data in self.datas[:5]])
+
+    def test_invalid_templates(self):
+        # Errors are raised by the call, before the results are iterated
+        spawn = multiprocessing.get_context('spawn')
+        self.assertRaises(ValueError, transform_parallel, self.datas, self.match_template, self.format_template, mp_context=spawn)
+
+        compiled = InNOut.compile(self.match_template)
+        compiled.template['other'] = S('other')
+        self.assertRaises(TemplateMutatedException, transform_parallel, self.datas, compiled, {'name': S('name')})
+
+
+class TestStreaming(unittest.TestCase):
+    def assertSameMatch(self, template, data):
+        self.assertEqual(match_stream(template, object_events(data)).storage, match(template, data).storage)
+
+    def test_stream_storage(self):
+        self.assertSameMatch(test_match_template, test_data)
+
+    def test_stream_filter(self):
+        match_template = {
+            'profiles': [{
+                'username': S('username'),
+                'permissions': [S('permissions')],
+                'role': 'admin'
+            }, {
+                'username': S('username'),
+                'user_id': S('user_id'),
+                'role': 'user'
+            }],
+        }
+        data = {
+            'profiles': [{
+                'username': 'marc',
+                'permissions': ['access_1', 'access_2'],
+                'role': 'admin',
+                'user_id': 'marc_1234'
+            }, {
+                'role': 'user',
+                'username': 'bryan',
+                'permissions': ['user_access_1'],
+                'user_id': 'bryan_1234'
+            }]
+        }
+        self.assertSameMatch(match_template, data)
+
+    def test_stream_template_order(self):
+        # Data keys are not in the template order, stores must still be in template order
+        match_template = {
+            'data_id': S('data_id'),
+            'profiles': [{'first_name': S('first_name')}],
+            'addresses': [{'street': S('street')}],
+        }
+        data = {
+            'addresses': [{'street': 'mcAllister', 'number': 1}, {'street': 'market'}],
+            'unused': {'a': [1, 2, {'b': 3}]},
+            'profiles': [{'first_name': 'Marc'}, {'last_name': 'Simon'}],
+            'data_id': 123,
+        }
+        self.assertSameMatch(match_template, data)
+
+    def test_stream_trans(self):
+        match_template = {
+            'name': MatchTrans({
+                'first_name': S('first_name'),
+                'last_name': S('last_name'),
+            }, lambda x: dict(zip(['first_name', 'last_name'], x['full'].split(' ')))),
+            'missing': MatchTrans(S('missing'), lambda x: 'default' if x is None else x),
+        }
+        data = {'name': {'full': 'Marc Simon'}}
+        self.assertSameMatch(match_template, data)
+        self.assertEqual(match_stream(match_template, object_events(data)).root_store.values['missing'], 'default')
+
+    def test_stream_signal_order(self):
+        # The last value of a repeated signal follows the template order, not the data order
+        match_template = {'name': S('name'), 'profile': {'name': S('name')}, 'items': [{'id': S('id')}]}
+        self.assertSameMatch(match_template, {'profile': {'name': 'inner'}, 'name': 'outer'})
+        self.assertSameMatch(match_template, {'items': [{'id': 1}], 'profile': {'name': 'inner'}, 'name': 'outer'})
+        self.assertSameMatch({'profile': {'name': S('name')}, 'name': S('name')}, {'name': 'outer', 'profile': {'name': 'inner'}})
+
+    def test_stream_trans_on_null(self):
+        match_template = {'items': [{'code': MatchTrans(S('code'), lambda x: x or 'default')}]}
+        self.assertSameMatch(match_template, {'items': [[None]]})
+        self.assertSameMatch(match_template, {'items': [[None, {'code': 'a'}], [{'code': 'b'}], []]})
+        self.assertEqual(len(match_stream(match_template, object_events({'items': [[None]]})).root_store.children), 1)
+
+    @unittest.skipIf(ijson is None, "ijson is not installed")
+    def test_stream_json(self):
+        document = json.dumps(test_data).encode()
+        self.assertEqual(list(json_events(io.BytesIO(document))), list(object_events(test_data)))
+        m = match_stream(test_match_template, json_events(io.BytesIO(document)))
+        self.assertEqual(m.storage, match(test_match_template, test_data).storage)
+
+    def test_stream_json_without_ijson(self):
+        with unittest.mock.patch(f"{__package__}.streaming.ijson", None):
+            self.assertRaises(ModuleNotFoundError, json_events, io.BytesIO(b'{}'))
+
+    def test_stream_xmltodict(self):
+        self.assertSameMatch({'profile': {'first_name': S('first_name')}}, {'profile': [{'first_name': 'Marc'}, {'first_name': 'Bryan'}]})
+        self.assertSameMatch({'profile': [{'first_name': S('first_name')}]}, {'profile': {'first_name': 'Marc'}})
+
+    def test_stream_xml(self):
+        xml = b'''
+            <loans>
+                <loan id="1"><borrower>Marc</borrower><amount currency="USD">100</amount><note>a</note><note>b</note></loan>
+                <loan id="2"><borrower>Bryan</borrower><amount currency="USD">200</amount></loan>
+                <ignored><loan id="3"/></ignored>
+            </loans>
+        '''
+        match_template = {
+            'loans': {
+                'loan': [{
+                    '@id': S('id'),
+                    'borrower': S('borrower'),
+                    'amount': {'#text': S('amount'), '@currency': 'USD'},
+                    'note': [S('notes')],
+                }]
+            }
+        }
+        m = match_stream(match_template, xml_events(io.BytesIO(xml)))
+        self.assertEqual(m.format([{'id': S('id'), 'borrower': S('borrower'), 'amount': S('amount'), 'notes': [S('notes')]}]), [
+            {'id': '1', 'borrower': 'Marc', 'amount': '100', 'notes': ['a', 'b']},
+            {'id': '2', 'borrower': 'Bryan', 'amount': '200', 'notes': []},
+        ])
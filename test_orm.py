@@ -0,0 +1,199 @@
+from django.db import connection, models
+from django.db.models import Prefetch
+from django.test import TestCase, modify_settings
+
+from . import transform, prefetch_queryset, project_queryset, S
+from .in_n_out import InNOut
+
+
+# Test models belong to the package, installed as an application by ModelTestCase
+test_app_label = __package__.rpartition('.')[2]
+
+
+class Borrower(models.Model):
+    name = models.CharField(max_length=64)
+
+    class Meta:
+        app_label = test_app_label
+
+
+class Loan(models.Model):
+    borrower = models.ForeignKey(Borrower, related_name='loans', on_delete=models.CASCADE)
+    amount = models.IntegerField()
+    notes = models.TextField(default='')
+
+    class Meta:
+        app_label = test_app_label
+
+
+class Payment(models.Model):
+    loan = models.ForeignKey(Loan, related_name='payments', on_delete=models.CASCADE)
+    amount = models.IntegerField()
+
+    class Meta:
+        app_label = test_app_label
+
+
+# No related_name, reached from the borrower through the default `document_set` accessor
+class Document(models.Model):
+    borrower = models.ForeignKey(Borrower, on_delete=models.CASCADE)
+    title = models.CharField(max_length=64)
+
+    class Meta:
+        app_label = test_app_label
+
+
+@modify_settings(INSTALLED_APPS={'append': __package__})
+class ModelTestCase(TestCase):
+    '''
+    Create the tables of the test models in the test database
+    '''
+    models = [Borrower, Loan, Payment, Document]
+
+    @classmethod
+    def setUpClass(cls):
+        with connection.schema_editor() as editor:
+            for model in cls.models:
+                editor.create_model(model)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as editor:
+            for model in reversed(cls.models):
+                editor.delete_model(model)
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(5):
+            borrower = Borrower.objects.create(name=f"borrower_{i}")
+            loan = Loan.objects.create(borrower=borrower, amount=i * 100)
+            for j in range(i):
+                Payment.objects.create(loan=loan, amount=j)
+                Document.objects.create(borrower=borrower, title=f"document_{j}")
+
+
+class TestPrefetch(ModelTestCase):
+    match_template = [{
+        'amount': S('amount'),
+        'borrower': {
+            'name': S('name'),
+        },
+        'payments': [{
+            'amount': S('payment'),
+        }],
+    }]
+    format_template = [{
+        'name': S('name'),
+        'amount': S('amount'),
+        'payments': [S('payment')],
+    }]
+
+    def test_prefetch_queryset(self):
+        loans = prefetch_queryset(self.match_template, Loan.objects.order_by('id'))
+        self.assertEqual(loans.query.select_related, {'borrower': {}})
+        self.assertEqual(loans._prefetch_related_lookups, ('payments',))
+
+        borrowers = prefetch_queryset([{'name': S('borrower'), 'loans': [self.match_template[0]]}], Borrower.objects.all())
+        self.assertEqual(borrowers.query.select_related, False)
+        self.assertEqual(borrowers._prefetch_related_lookups, ('loans', 'loans__borrower', 'loans__payments'))
+
+    def test_bounded_queries(self):
+        with self.assertNumQueries(1 + 5 + 5):
+            expected = InNOut(self.match_template, Loan.objects.order_by('id'), prefetch=False).format(self.format_template)
+
+        with self.assertNumQueries(2):
+            res = transform(Loan.objects.order_by('id'), self.match_template, self.format_template)
+
+        self.assertEqual(res, expected)
+        self.assertEqual(res[4], {'name': 'borrower_4', 'amount': 400, 'payments': [0, 1, 2, 3]})
+
+    def test_project_queryset(self):
+        loans = list(project_queryset(self.match_template, Loan.objects.order_by('id')))
+        self.assertEqual(loans[0].get_deferred_fields(), {'notes'})
+        self.assertEqual(loans[0].borrower.get_deferred_fields(), set())
+        self.assertEqual(loans[1].payments.all()[0].get_deferred_fields(), set())
+
+        # Only fields of the model, rows are read as dictionaries
+        loans = project_queryset([{'amount': S('amount'), 'borrower_id': 1}], Loan.objects.order_by('id'))
+        self.assertEqual(list(loans)[:2], [{'amount': 0, 'borrower_id': 1}, {'amount': 100, 'borrower_id': 2}])
+
+        # Properties & methods may need any field
+        loans = list(project_queryset([{'amount': S('amount'), 'pk': S('pk')}], Loan.objects.all()))
+        self.assertEqual(loans[0].get_deferred_fields(), set())
+
+    def test_values_queryset(self):
+        # Rows are dictionaries, relations aren't followed
+        loans = Loan.objects.order_by('id').values('amount', 'borrower')
+        self.assertIs(prefetch_queryset(self.match_template, loans), loans)
+        self.assertIs(project_queryset(self.match_template, loans), loans)
+
+        format_template = [{'amount': S('amount'), 'name': S('name')}]
+        expected = [{'amount': i * 100} for i in range(5)]
+        self.assertEqual(transform(loans, self.match_template, format_template), expected)
+        self.assertEqual(InNOut(self.match_template, loans, project=True).format(format_template), expected)
+
+    def test_combined_queryset(self):
+        # Combined querysets don't take lookups, rows are matched without them
+        loans = Loan.objects.filter(amount=0).union(Loan.objects.filter(amount=100)).order_by('amount')
+        self.assertIs(prefetch_queryset(self.match_template, loans), loans)
+        self.assertIs(project_queryset(self.match_template, loans), loans)
+
+        expected = transform(Loan.objects.filter(amount__lte=100).order_by('amount'), self.match_template, self.format_template)
+        self.assertEqual(transform(loans, self.match_template, self.format_template), expected)
+        self.assertEqual(InNOut(self.match_template, loans, project=True).format(self.format_template), expected)
+
+    def test_default_related_name(self):
+        match_template = [{'name': S('name'), 'document_set': [{'title': S('title')}]}]
+        format_template = [{'name': S('name'), 'titles': [S('title')]}]
+        borrowers = prefetch_queryset(match_template, Borrower.objects.all())
+        self.assertEqual(borrowers._prefetch_related_lookups, ('document_set',))
+
+        with self.assertNumQueries(1 + 5):
+            expected = InNOut(match_template, Borrower.objects.order_by('id'), prefetch=False).format(format_template)
+        self.assertEqual(expected[2], {'name': 'borrower_2', 'titles': ['document_0', 'document_1']})
+
+        with self.assertNumQueries(2):
+            res = transform(Borrower.objects.order_by('id'), match_template, format_template)
+        self.assertEqual(res, expected)
+
+        # The relation isn't read as a column of the borrower
+        with self.assertNumQueries(2):
+            res = InNOut(match_template, Borrower.objects.order_by('id'), project=True).format(format_template)
+        self.assertEqual(res, expected)
+
+    def test_project(self):
+        expected = transform(Loan.objects.order_by('id'), self.match_template, self.format_template)
+        with self.assertNumQueries(2):
+            res = InNOut(self.match_template, Loan.objects.order_by('id'), project=True).format(self.format_template)
+        self.assertEqual(res, expected)
+
+        with self.assertNumQueries(1):
+            res = InNOut([{'amount': S('amount')}], Loan.objects.order_by('id'), project=True).format([S('amount')])
+        self.assertEqual(res, [0, 100, 200, 300, 400])
+
+    def test_project_prefetched(self):
+        # Lookups already prefetched by the caller keep their queryset
+        loans = Loan.objects.order_by('id').prefetch_related(Prefetch('payments', queryset=Payment.objects.filter(amount__gt=0)))
+        with self.assertNumQueries(2):
+            res = InNOut(self.match_template, loans, project=True).format(self.format_template)
+        self.assertEqual(res, transform(loans, self.match_template, self.format_template))
+        self.assertEqual(res[4], {'name': 'borrower_4', 'amount': 400, 'payments': [1, 2, 3]})
+
+        # Rows stay model instances for the prefetched lookups
+        res = InNOut([{'amount': S('amount')}], Loan.objects.prefetch_related('payments'), project=True).format([S('amount')])
+        self.assertEqual(sorted(res), [0, 100, 200, 300, 400])
+
+    def test_chunk_size(self):
+        expected = transform(Loan.objects.order_by('id'), self.match_template, self.format_template)
+        loans = Loan.objects.order_by('id')
+        # One query for the loans, and one for the payments of each chunk
+        with self.assertNumQueries(1 + 3):
+            res = InNOut(self.match_template, loans, chunk_size=2).format(self.format_template)
+        self.assertEqual(res, expected)
+        self.assertIsNone(loans._result_cache)
+
+        # Rows visited by several templates are cached
+        with self.assertNumQueries(2):
+            InNOut([self.match_template[0], {'amount': S('other')}], Loan.objects.all(), chunk_size=2)
@@ -1,17 +1,74 @@
-from pydash import _
+LEFT = 'left'
+INNER = 'inner'
+
+
+def _join_key(on):
+    '''
+    Function returning the join key of a dictionary, `on` is a key or a list of keys
+    '''
+    if isinstance(on, (list, tuple)):
+        return lambda row: tuple(row.get(key) for key in on)
+    return lambda row: row.get(on)
+
+
+def _merge(target, value):
+    # Later non None values win
+    for k, v in value.items():
+        if v is not None:
+            target[k] = v
+
 
 def dict_join(x, on):
     '''
-    Take a list of dictionary and join then on `on`
+    Take a list of dictionary and join then on `on`, a key or a list of keys.
+    Dictionaries with the same values for `on` are merged into the first one, the later non None values winning.
+    Values of `on` must be hashable.
+    '''
+    key = _join_key(on)
+    index = {}
+    result = []
+    for value in x:
+        k = key(value)
+        if k in index:
+            _merge(index[k], value)
+        else:
+            index[k] = value
+            result.append(value)
+    return result
+
+
+def stream_join(left, right, on, how=LEFT):
+    '''
+    Join the dictionaries of `left` with the ones of `right` having the same values for `on`, a key or a list of keys.
+    Only `right` is held in memory, indexed by `on`. `left` is consumed lazily, and joined dictionaries yielded one by one.
+    Each joined dictionary is a copy of the left one, merged with the right ones as done by `dict_join`.
+
+    how: LEFT keeps the left dictionaries without a right one, INNER drops them
     '''
-    def reducer(acc, value):
-        el = _.find(acc, lambda x: x.get(on) == value.get(on))
-        if el:
-            for k,v in value.items():
-                if v is not None:
-                    el[k] = v
+    if how not in (LEFT, INNER):
+        raise ValueError(f"Unknown join {how}, expected one of {LEFT}, {INNER}")
+
+    key = _join_key(on)
+    index = {}
+    for value in right:
+        k = key(value)
+        if k in index:
+            _merge(index[k], value)
         else:
-            acc.append(value)
-        return acc
+            index[k] = dict(value)
 
-    return _.reduce(x, reducer, [])
+    for value in left:
+        match = index.get(key(value))
+        if match is None and how == INNER:
+            continue
+        value = dict(value)
+        if match is not None:
+            _merge(value, match)
+        yield value
+
+
+def join(left, right, on, how=LEFT):
+    '''
+    List of the joined dictionaries of `left` and `right`, check `stream_join`
+    '''
+    return list(stream_join(left, right, on, how))